@@ -1,5 +1 @@
-import sys
-
-sys.path.append("cmapping")
-
 from ext4.filesystem import FileSystem
@@ -0,0 +1,230 @@
+'''Block and inode bitmaps.
+Bitmaps are loaded per group on first use and cached as packed bit
+arrays (bytes), bit i of group is bit (i % 8) of byte (i // 8).
+Counting is done by bytes.translate into per-byte popcounts, runs are
+searched skipping whole bytes, so queries do not walk bits one by one.
+'''
+
+import re
+
+from ext4.cache import LRUCache
+from ext4.consts import EXT4_BG_INODE_UNINIT, EXT4_BG_BLOCK_UNINIT, \
+                        RO_COMPAT_GDT_CSUM, RO_COMPAT_METADATA_CSUM, \
+                        RO_COMPAT_SPARSE_SUPER, COMPAT_SPARSE_SUPER2, \
+                        INCOMPAT_META_BG
+
+
+BITMAP_CACHE_ENTRIES = 1024
+
+POPCOUNT = bytes(bin(x).count('1') for x in range(256))
+
+# spans of bytes which contain at least one bit with value 0 / 1
+_SPANS = {0: re.compile(b'[^\xff]+'), 1: re.compile(b'[^\x00]+')}
+
+
+def count_bits(bitmap, start, end):
+    '''Count set bits in range [start, end) of bitmap.'''
+    if start >= end:
+        return 0
+    first_byte, last_byte = start >> 3, (end - 1) >> 3
+    if first_byte == last_byte:
+        mask = (0xFF << (start & 7)) & (0xFF >> (7 - ((end - 1) & 7)))
+        return POPCOUNT[bitmap[first_byte] & mask]
+    head = POPCOUNT[bitmap[first_byte] & (0xFF << (start & 7)) & 0xFF]
+    tail = POPCOUNT[bitmap[last_byte] & (0xFF >> (7 - ((end - 1) & 7)))]
+    middle = sum(bitmap[first_byte + 1:last_byte].translate(POPCOUNT))
+    return head + middle + tail
+
+
+def bit_runs(bitmap, count, value=1):
+    '''Yields ranges [first, end) of bits equal to value among first
+    count bits of bitmap.'''
+    for first, end in _byte_runs(bitmap, (count + 7) >> 3, value):
+        if first >= count:
+            break
+        yield first, min(end, count)
+
+
+def _byte_runs(bitmap, size, value):
+    '''Same as bit_runs for first size bytes, runs are not clipped.'''
+    full = 0xFF if value else 0x00
+    first = None
+    for span in _SPANS[value].finditer(bitmap, 0, size):
+        for index in range(span.start(), span.end()):
+            byte, base = bitmap[index], index << 3
+            if byte == full:
+                if first is None:
+                    first = base
+                continue
+            for bit in range(8):
+                if byte >> bit & 1 == value:
+                    if first is None:
+                        first = base + bit
+                elif first is not None:
+                    yield first, base + bit
+                    first = None
+        # byte after span has no bits equal to value
+        if first is not None:
+            yield first, span.end() << 3
+            first = None
+
+
+def group_has_super(sb, group):
+    '''True if block group stores superblock (primary or backup).'''
+    if group == 0:
+        return True
+    if sb.feature_compat & COMPAT_SPARSE_SUPER2:
+        return group in sb.backup_bgs
+    if group == 1 or not sb.feature_ro_compat & RO_COMPAT_SPARSE_SUPER:
+        return True
+    for base in (3, 5, 7):
+        power = base
+        while power < group:
+            power *= base
+        if power == group:
+            return True
+    return False
+
+
+def base_meta_blocks(fs, group):
+    '''Count of blocks at start of group taken by superblock backup and
+    group descriptors, see ext4_num_base_meta_clusters in the kernel.'''
+    sb = fs.sb
+    has_super = group_has_super(sb, group)
+    per_block = sb.block_size // fs.desc_size
+    if not sb.feature_incompat & INCOMPAT_META_BG or \
+            group < sb.first_meta_bg * per_block:
+        if not has_super:
+            return 0
+        if sb.feature_incompat & INCOMPAT_META_BG:
+            gdt_blocks = sb.first_meta_bg
+        else:
+            gdt_blocks = -(-fs.groups_count // per_block)
+        return 1 + gdt_blocks + sb.reserved_gdt_blocks
+    # meta_bg: descriptors block is in first, second and last group
+    # of each meta group
+    return int(has_super) + int(group % per_block in (0, 1, per_block - 1))
+
+
+class Bitmaps:
+    '''Lazily loaded and cached block and inode bitmaps of filesystem.
+    Bitmaps of groups with BLOCK_UNINIT / INODE_UNINIT flags are not
+    read: inodes of such group are all free, its blocks are free except
+    its own metadata blocks (superblock backup, descriptors, bitmaps and
+    inode table), as ext4_init_block_bitmap computes them.
+    '''
+    def __init__(self, fs, cache_entries=BITMAP_CACHE_ENTRIES):
+        self.fs = fs
+        self.cache = LRUCache(cache_entries)
+        self.has_csum = fs.sb.feature_ro_compat & \
+            (RO_COMPAT_GDT_CSUM | RO_COMPAT_METADATA_CSUM)
+
+    def block_bitmap(self, group):
+        '''Block bitmap of group as bytes.'''
+        return self.__load('block', group, self.fs.gdt.block_bitmap,
+                           EXT4_BG_BLOCK_UNINIT, self.fs.sb.blocks_per_group,
+                           self.__uninit_block_bitmap)
+
+    def inode_bitmap(self, group):
+        '''Inode bitmap of group as bytes.'''
+        return self.__load('inode', group, self.fs.gdt.inode_bitmap,
+                           EXT4_BG_INODE_UNINIT, self.fs.sb.inodes_per_group,
+                           lambda group, size: bytes(size))
+
+    def __load(self, kind, group, column, uninit_flag, bits, init):
+        key = (kind, group)
+        bitmap = self.cache.get(key)
+        if bitmap is None:
+            size = (bits + 7) >> 3
+            if self.has_csum and self.fs.gdt.flags[group] & uninit_flag:
+                bitmap = init(group, size)
+            else:
+                start = column[group] * self.fs.sb.block_size
+                bitmap = self.fs.read(start, size)
+            self.cache.put(key, bitmap)
+        return bitmap
+
+    def __uninit_block_bitmap(self, group, size):
+        '''Build bitmap of BLOCK_UNINIT group: only group metadata stored
+        in the group itself is allocated.'''
+        bitmap = bytearray(size)
+
+        def mark(first, count):
+            for index in range(max(first, 0),
+                               min(first + count, size << 3)):
+                bitmap[index >> 3] |= 1 << (index & 7)
+
+        sb, gdt = self.fs.sb, self.fs.gdt
+        base = sb.first_data_block + group * sb.blocks_per_group
+        table_blocks = -(-sb.inodes_per_group * sb.inode_size //
+                         sb.block_size)
+        mark(0, base_meta_blocks(self.fs, group))
+        mark(gdt.block_bitmap[group] - base, 1)
+        mark(gdt.inode_bitmap[group] - base, 1)
+        mark(gdt.inode_table[group] - base, table_blocks)
+        return bytes(bitmap)
+
+    def block_group(self, block):
+        '''Return pair (group, index in group) of block. Blocks before
+        first_data_block (boot block of 1K filesystems) are in no group.'''
+        if block < self.fs.sb.first_data_block:
+            raise ValueError('block %d precedes first data block' % block)
+        return divmod(block - self.fs.sb.first_data_block,
+                      self.fs.sb.blocks_per_group)
+
+    def is_block_allocated(self, block):
+        '''Blocks before first_data_block are always allocated.'''
+        if block < self.fs.sb.first_data_block:
+            return True
+        group, index = self.block_group(block)
+        return bool(self.block_bitmap(group)[index >> 3] >> (index & 7) & 1)
+
+    def is_inode_allocated(self, inode_index):
+        group, index = divmod(inode_index - 1, self.fs.sb.inodes_per_group)
+        return bool(self.inode_bitmap(group)[index >> 3] >> (index & 7) & 1)
+
+    def count_allocated_blocks(self, start, length):
+        '''Count allocated blocks in range [start, start + length).
+        Range may span several groups, blocks before first_data_block
+        are counted as allocated.'''
+        per_group = self.fs.sb.blocks_per_group
+        end = min(start + length, self.fs.sb.blocks_count)
+        first_data = min(self.fs.sb.first_data_block, end)
+        allocated = max(first_data - start, 0)
+        start = max(start, first_data)
+        while start < end:
+            group, index = self.block_group(start)
+            count = min(end - start, per_group - index)
+            allocated += count_bits(self.block_bitmap(group),
+                                    index, index + count)
+            start += count
+        return allocated
+
+    def count_free_blocks(self, group):
+        return self.__group_blocks(group) - \
+            count_bits(self.block_bitmap(group), 0, self.__group_blocks(group))
+
+    def count_free_inodes(self, group):
+        per_group = self.fs.sb.inodes_per_group
+        return per_group - count_bits(self.inode_bitmap(group), 0, per_group)
+
+    def free_block_runs(self, group):
+        '''Yields ranges [first, end) of free blocks of group as absolute
+        block numbers.'''
+        base = self.fs.sb.first_data_block + group * self.fs.sb.blocks_per_group
+        bitmap = self.block_bitmap(group)
+        for first, end in bit_runs(bitmap, self.__group_blocks(group), 0):
+            yield base + first, base + end
+
+    def allocated_inode_runs(self, group, count=None):
+        '''Yields ranges [first, end) of allocated inodes of group as
+        indexes in group inode table.'''
+        if count is None:
+            count = self.fs.sb.inodes_per_group
+        return bit_runs(self.inode_bitmap(group), count, 1)
+
+    def __group_blocks(self, group):
+        '''Count of blocks in group, last group may be shorter.'''
+        per_group = self.fs.sb.blocks_per_group
+        first = self.fs.sb.first_data_block + group * per_group
+        return min(per_group, self.fs.sb.blocks_count - first)
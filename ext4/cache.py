@@ -0,0 +1,87 @@
+from collections import OrderedDict
+
+
+class CacheStats:
+    '''Counters of cache usage.'''
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return '<CacheStats: {s.hits} hits, {s.misses} misses, ' \
+               '{s.evictions} evictions>'.format(s=self)
+
+
+class LRUCache:
+    '''Bounded least recently used cache.
+    Cache is bounded both by number of entries and by total size of
+    entries in bytes, size of each entry is estimated by sizeof(value).
+    None as a bound means "unlimited".
+    '''
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof if sizeof is not None else lambda value: 0
+        self.stats = CacheStats()
+        self.bytes = 0
+        self.__entries = OrderedDict()    # {key -> (value, size)}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def get(self, key, default=None):
+        '''Return cached value and mark it as recently used.'''
+        try:
+            value, _ = self.__entries[key]
+        except KeyError:
+            self.stats.misses += 1
+            return default
+        self.__entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''Put value into cache evicting least recently used entries
+        if cache is over its budget.'''
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        if key in self.__entries:
+            self.bytes -= self.__entries.pop(key)[1]
+        self.__entries[key] = (value, size)
+        self.bytes += size
+        self.__shrink()
+
+    def pop(self, key, default=None):
+        '''Remove entry from cache and return its value.'''
+        if key not in self.__entries:
+            return default
+        value, size = self.__entries.pop(key)
+        self.bytes -= size
+        return value
+
+    def clear(self):
+        self.__entries.clear()
+        self.bytes = 0
+
+    def __shrink(self):
+        '''Evict least recently used entries until cache fits budget.'''
+        while self.__entries and self.__is_overflowed():
+            _, (_, size) = self.__entries.popitem(last=False)
+            self.bytes -= size
+            self.stats.evictions += 1
+
+    def __is_overflowed(self):
+        if self.max_entries is not None and \
+                len(self.__entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
@@ -7,6 +7,7 @@ from enum import IntEnum
 
 
 GROUP_0_PADDING = 1024
+ROOT_INODE = 2
 
 ''' Magic numbers '''
 SUPERBLOCK_MAGIC = -4269    # b'\x53\xEF'
@@ -25,6 +26,9 @@ DIR_ENTRY_HEADER_SIZE = 8
 DIR_ENTRY_TAIL_SIZE = 12
 DIR_ENTRY_TAIL_MAGIC = 222    # b'\xDE'
 
+''' Extents '''
+EXTENT_INIT_MAX_LEN = 32768
+
 
 class FileType(IntEnum):
     ''' Describes file type, which can be found in
@@ -95,6 +99,35 @@ S_IFLNK = 0xA000    # Symbolic link
 S_IFSOCK = 0xC000   # Socket
 
 
+''' Block group flags '''
+
+# Inode table and bitmap are not initialized.
+EXT4_BG_INODE_UNINIT = 0x1
+
+# Block bitmap is not initialized.
+EXT4_BG_BLOCK_UNINIT = 0x2
+
+# Inode table is zeroed.
+EXT4_BG_INODE_ZEROED = 0x4
+
+
+''' Superblock flags '''
+
+EXT2_FLAGS_SIGNED_HASH = 0x1
+EXT2_FLAGS_UNSIGNED_HASH = 0x2
+EXT2_FLAGS_TEST_FILESYS = 0x4
+
+
+''' Directory hash versions '''
+
+DX_HASH_LEGACY = 0x0
+DX_HASH_HALF_MD4 = 0x1
+DX_HASH_TEA = 0x2
+DX_HASH_LEGACY_UNSIGNED = 0x3
+DX_HASH_HALF_MD4_UNSIGNED = 0x4
+DX_HASH_TEA_UNSIGNED = 0x5
+
+
 ''' Ext4 compatible feature set flags '''
 
 # Directory preallocation.
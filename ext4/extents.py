@@ -0,0 +1,83 @@
+import sys
+from array import array
+from bisect import bisect_right
+
+
+class ExtentMap:
+    '''Mapping of in-file (logical) blocks to disk (physical) blocks,
+    built from leafs of extent tree. It is compiled once into compact
+    parallel arrays sorted by logical block, so extent containing any
+    logical block is found by binary search.
+    Uninitialized extents are kept in map, but flagged with uninit.
+    '''
+    def __init__(self, leafs):
+        leafs = sorted(leafs, key=lambda e: e.block)
+        self.logical = array('I', (x.block for x in leafs))
+        self.physical = array('Q', (x.start for x in leafs))
+        self.length = array('H', (x.length for x in leafs))
+        self.uninit = array('B', (x.uninit for x in leafs))
+
+    @property
+    def nbytes(self):
+        '''Estimated memory used by map.'''
+        columns = (self.logical, self.physical, self.length, self.uninit)
+        return sys.getsizeof(self) + sum(sys.getsizeof(x) for x in columns)
+
+    def __len__(self):
+        return len(self.logical)
+
+    def __iter__(self):
+        '''Yields (logical, physical, length, uninit) in logical order.'''
+        return zip(self.logical, self.physical, self.length, self.uninit)
+
+    def runs(self):
+        '''Yields (logical, physical, length, uninit) where extents which
+        are adjacent both in file and on disk and have the same uninit flag
+        are merged into one run.'''
+        run = None
+        for logical, physical, length, uninit in self:
+            if run is not None and run[0] + run[2] == logical and \
+                    run[1] + run[2] == physical and run[3] == uninit:
+                run[2] += length
+                continue
+            if run is not None:
+                yield tuple(run)
+            run = [logical, physical, length, uninit]
+        if run is not None:
+            yield tuple(run)
+
+    def find(self, block):
+        '''Return index of extent containing logical block or -1 if
+        block is not mapped (is a hole).'''
+        index = bisect_right(self.logical, block) - 1
+        if index >= 0 and block < self.logical[index] + self.length[index]:
+            return index
+        return -1
+
+    def segments(self, block_size, size):
+        '''Yields pairs (physical block or None, bytes count) which cover
+        file content from start to size. None means that segment is read as
+        zeros: it is a hole or uninitialized extent.'''
+        position = 0
+        for logical, physical, length, uninit in self.runs():
+            if position >= size:
+                return
+            hole = logical * block_size - position
+            if hole > 0:
+                hole = min(hole, size - position)
+                yield None, hole
+                position += hole
+                if position >= size:
+                    return
+            count = min(length * block_size, size - position)
+            yield (None if uninit else physical), count
+            position += count
+        if position < size:
+            yield None, size - position
+
+    def next_mapped(self, block):
+        '''Return first mapped logical block after block, or None.'''
+        index = bisect_right(self.logical, block)
+        if index < len(self.logical):
+            return self.logical[index]
+        return None
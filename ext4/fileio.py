@@ -0,0 +1,172 @@
+import io
+import os
+import errno
+from functools import partial
+
+from ext4.utils import iter_zeros
+
+
+class ExtentReader(io.RawIOBase):
+    '''Raw random-access reader of file content stored in image.
+    Position is translated to disk block through ExtentMap, so seeking
+    costs nothing and reading touches only requested blocks.
+    Unmapped blocks (holes) and uninitialized extents are read as zeros
+    without touching disk. Content is bounded by file size.
+    :param image: mmap of filesystem image
+    :param extent_map: ext4.extents.ExtentMap of file
+    '''
+    def __init__(self, image, extent_map, block_size, size, name=None):
+        super().__init__()
+        self.image = image
+        self.extent_map = extent_map
+        self.block_size = block_size
+        self.size = size
+        self.name = name
+        self.__position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.__position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+        if position < 0:
+            raise ValueError('Negative seek position {}'.format(position))
+        self.__position = position
+        return position
+
+    def readinto(self, buffer):
+        '''Read up to len(buffer) bytes into buffer.'''
+        with memoryview(buffer) as view, memoryview(self.image) as image:
+            view = view.cast('B')
+            end = min(len(view), max(self.size - self.__position, 0))
+            done = 0
+            while done < end:
+                count = self.__read_chunk(image, view[done:end])
+                self.__position += count
+                done += count
+            return done
+
+    def __read_chunk(self, image, view):
+        '''Fill view from the current position up to the end of extent or
+        hole containing it. Returns count of bytes read.'''
+        block, offset = divmod(self.__position, self.block_size)
+        extents = self.extent_map
+        index = extents.find(block)
+
+        if index == -1:
+            next_block = extents.next_mapped(block)
+            if next_block is None:
+                count = len(view)
+            else:
+                count = min(len(view),
+                            (next_block - block) * self.block_size - offset)
+            view[:count] = bytes(count)
+            return count
+
+        last = extents.logical[index] + extents.length[index]
+        count = min(len(view), (last - block) * self.block_size - offset)
+        if extents.uninit[index]:
+            view[:count] = bytes(count)
+            return count
+        physical = extents.physical[index] + block - extents.logical[index]
+        start = physical * self.block_size + offset
+        view[:count] = image[start:start+count]
+        return count
+
+
+# Chunk of single kernel copy or mmap slice written at once
+COPY_CHUNK_SIZE = 16 * 1024**2
+
+# errors meaning that copy syscall is not supported for these files
+_UNSUPPORTED = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,
+                errno.ENOTSUP, errno.EBADF)
+
+
+def _copy_file_range(out_fd, image_fd, image, offset, count):
+    return os.copy_file_range(image_fd, out_fd, count, offset)
+
+
+def _sendfile(out_fd, image_fd, image, offset, count):
+    return os.sendfile(out_fd, image_fd, offset, count)
+
+
+def _write_slice(out_fd, image_fd, image, offset, count):
+    with memoryview(image) as view:
+        return os.write(out_fd, view[offset:offset+count])
+
+
+def _write_hashed_slice(digest, out_fd, image_fd, image, offset, count):
+    with memoryview(image) as view, view[offset:offset+count] as data:
+        done = os.write(out_fd, data)
+        digest.update(data[:done])
+        return done
+
+
+def copy_segments(out_fd, image_fd, image, segments, block_size,
+                  digest=None):
+    '''Write file content described by segments (pairs of physical block
+    or None and bytes count, see ExtentMap.segments) to out_fd, starting
+    at its current position. Data is copied by the kernel with
+    copy_file_range or sendfile where possible, otherwise written from
+    image mmap slices, so memory use does not depend on file size.
+    Zero segments are skipped by seeking, so they become holes of sparse
+    output. Returns count of bytes of content.
+    :param image_fd: file descriptor of filesystem image
+    :param image: mmap of filesystem image
+    :param digest: hashlib object updated with content; data is then
+                   written from mmap slices, so it is hashed as it is
+                   written and read from image once
+    '''
+    if digest is not None:
+        methods = [partial(_write_hashed_slice, digest)]
+    else:
+        methods = [_write_slice]
+        if hasattr(os, 'sendfile'):
+            methods.insert(0, _sendfile)
+        if hasattr(os, 'copy_file_range'):
+            methods.insert(0, _copy_file_range)
+
+    start = os.lseek(out_fd, 0, os.SEEK_CUR)
+    position = start
+    for physical, count in segments:
+        end = position + count
+        if physical is not None:
+            offset = physical * block_size
+            count = min(count, max(len(image) - offset, 0))
+            while count > 0:
+                chunk = min(count, COPY_CHUNK_SIZE)
+                try:
+                    done = methods[0](out_fd, image_fd, image, offset, chunk)
+                except OSError as error:
+                    if error.errno not in _UNSUPPORTED or len(methods) == 1:
+                        raise
+                    methods.pop(0)
+                    continue
+                if done == 0:
+                    break
+                offset += done
+                count -= done
+                position += done
+        # unreadable part of truncated image is left as a hole too
+        if digest is not None:
+            for zeros in iter_zeros(end - position):
+                digest.update(zeros)
+        position = end
+        os.lseek(out_fd, position, os.SEEK_SET)
+
+    # zero tail is not written, so size is set explicitly
+    os.ftruncate(out_fd, position)
+    return position - start
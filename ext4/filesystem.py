@@ -1,24 +1,68 @@
+import io
 import os
+import sys
+import struct
 import mmap
+import hashlib
 from math import ceil
 
 from ext4.structs import *
 from ext4.consts import *
 from ext4.journal import Journal
-from ext4.utils import padded_with_zeroes, del_trailing_zeros, \
-                       disassemble_path
-from ext4.fsinfo import DirectoryInfo, FileInfo
+from ext4.jmap import journal_map_signature, read_journal_map, \
+                      write_journal_map
+from ext4.groups import GroupDescriptorTable
+from ext4.cache import LRUCache
+from ext4.bitmap import Bitmaps
+from ext4.htree import find_leaf_blocks
+from ext4.extents import ExtentMap
+from ext4.fileio import ExtentReader, copy_segments
+from ext4.utils import padded_with_zeroes, disassemble_path, iter_zeros
+from ext4.fsinfo import DirectoryInfo, FileInfo, read_entries
+
+
+INODE_CACHE_ENTRIES = 4096
+INODE_CACHE_BYTES = 4 * 1024**2
+DENTRY_CACHE_ENTRIES = 16384
+PATH_CACHE_ENTRIES = 4096
+EXTENT_CACHE_ENTRIES = 1024
+EXTENT_CACHE_BYTES = 16 * 1024**2
+
+# file size and segments of content, see FileSystem.data_fingerprint
+SIZE_STRUCT = struct.Struct('<Q')
+SEGMENT_STRUCT = struct.Struct('<QQ')
+SEGMENT_HOLE = 0xFFFFFFFFFFFFFFFF
 
 
 class FileSystem:
     '''File System abstraction to operate ext4 image.'''
-    def __init__(self, image_file):
-        '''image_file -> file object with fileno() method'''
+    def __init__(self, image_file, inode_cache_entries=INODE_CACHE_ENTRIES,
+                 inode_cache_bytes=INODE_CACHE_BYTES,
+                 dentry_cache_entries=DENTRY_CACHE_ENTRIES,
+                 path_cache_entries=PATH_CACHE_ENTRIES,
+                 extent_cache_entries=EXTENT_CACHE_ENTRIES,
+                 extent_cache_bytes=EXTENT_CACHE_BYTES):
+        '''image_file -> file object with fileno() method
+        inode_cache_entries, inode_cache_bytes -> budget of decoded inodes
+        cache, None means unlimited.
+        dentry_cache_entries, path_cache_entries -> budget of
+        (directory, name) -> inode and path -> inode caches.
+        extent_cache_entries, extent_cache_bytes -> budget of compiled
+        extent maps cache.
+        '''
         self.image_file = image_file
         self.image = self.__create_mmap(image_file)
         self.sb = SuperBlock(self.read(GROUP_0_PADDING, SUPERBLOCK_SIZE))
         self.sb.last_mounted = self.sb.last_mounted.decode()
         self.size = self.sb.blocks_count * self.sb.block_size
+        self.gdt = self.__load_group_desc_table()
+        self.inodes = LRUCache(inode_cache_entries, inode_cache_bytes,
+                               sizeof_inode)
+        self.dentries = LRUCache(dentry_cache_entries)
+        self.paths = LRUCache(path_cache_entries)
+        self.extent_maps = LRUCache(extent_cache_entries, extent_cache_bytes,
+                                    lambda x: x.nbytes)
+        self.bitmaps = Bitmaps(self)
 
     def __create_mmap(self, image_file):
         '''Create platform depended mmap object'''
@@ -26,7 +70,14 @@ class FileSystem:
 
     def __del__(self):
         '''Closes mmap and file with filesystem image'''
-        self.image.close()
+        if hasattr(self, '_journal'):
+            self._journal.close()
+        try:
+            self.image.close()
+        except BufferError:
+            # views of image are still held by caller, mmap is unmapped
+            # when the last of them is released
+            pass
         self.image_file.close()
 
     def __enter__(self):
@@ -35,6 +86,21 @@ class FileSystem:
     def __exit__(self, exc_type, exc_value, traceback):
         pass
 
+    def __load_group_desc_table(self):
+        '''Decode whole group descriptor table into array columns.'''
+        start = self.__group_desc_table_offset()
+        data = self.read(start, self.desc_size * self.groups_count)
+        return GroupDescriptorTable(data, self.desc_size, bool(self.is64))
+
+    def __group_desc_table_offset(self):
+        '''Offset of the first group descriptor.'''
+        return max(GROUP_0_PADDING + SUPERBLOCK_SIZE, self.sb.block_size)
+
+    @property
+    def groups_count(self):
+        data_blocks = self.sb.blocks_count - self.sb.first_data_block
+        return ceil(data_blocks / self.sb.blocks_per_group)
+
     @property
     def is64(self):
         return self.sb.feature_incompat & INCOMPAT_64BIT
@@ -45,22 +111,91 @@ class FileSystem:
 
     def open(self, path, encoding=None):
         '''Open file or directory as FileSystemInfo.'''
-        path = disassemble_path(path)
-        current_path = '/'
+        inode_no, parent, name = self.resolve_path(path)
+        return self.__open_entry(inode_no, name, parent, encoding)
 
-        current = self.__open_entry(2, '/', '.')
-        for _next in filter(lambda x: x, path):
-            _next_entry = [e for e in current.get_entries() if e.name == _next]
-            if len(_next_entry) == 0:
+    def resolve_path(self, path):
+        '''Find inode of file or directory by its path.
+        Returns triple (inode number, path of parent directory, name).
+        Resolved paths and directory entries are cached.
+        '''
+        parts = list(disassemble_path(path))
+        key = '/' + '/'.join(parts)
+        resolved = self.paths.get(key)
+        if resolved is not None:
+            return resolved
+
+        inode_no, parent, name = ROOT_INODE, '.', '/'
+        for part in parts:
+            dir_no = self.__follow_symlink(inode_no, parent)
+            parent = os.path.join(parent, name)
+            inode_no, name = self.lookup(dir_no, part), part
+            if inode_no == 0:
                 error = FileNotFoundError('Not found file or firectory!')
-                error.filename = _next
+                error.filename = part
                 raise error
-            e = _next_entry[0]
-            current = self.__open_entry(e.inode, e.name,
-                                        current_path, encoding)
-            current_path = os.path.join(current_path, e.name)
 
-        return current
+        resolved = inode_no, parent, name
+        self.paths.put(key, resolved)
+        return resolved
+
+    def lookup(self, dir_inode_no, name):
+        '''Find inode number of entry [name] in directory with inode
+        [dir_inode_no]. Returns 0 if there is no such entry.
+        Both found and missing entries are cached.
+        '''
+        key = (dir_inode_no, name)
+        inode_no = self.dentries.get(key)
+        if inode_no is None:
+            inode_no = self.__scan_directory(dir_inode_no, name)
+            self.dentries.put(key, inode_no)
+        return inode_no
+
+    def __scan_directory(self, dir_inode_no, name):
+        '''Search entry [name] through directory blocks. Hashed directories
+        are searched through index, others are scanned linearly.'''
+        inode = self.open_inode(dir_inode_no)
+        if not inode.mode & S_IFDIR:
+            return 0
+        blocks = None
+        if self.sb.feature_compat & COMPAT_DIR_INDEX and \
+                inode.flags & EXT4_INDEX_FL:
+            if name in ('.', '..'):
+                # both are stored only in dx_root, they are not hashed
+                blocks = [self.read_file_block(inode, 0)]
+            else:
+                blocks = self.__read_htree_leafs(inode, name)
+        if blocks is None:
+            blocks = self.read_file_blocks(inode)
+        for entry in read_entries(blocks):
+            if entry.name == name:
+                return entry.inode
+        return 0
+
+    def __read_htree_leafs(self, inode, name):
+        '''Return leaf blocks of hashed directory where name can be stored.
+        None means that index is broken and linear scan should be used.'''
+        def read_block(logical):
+            return self.read_file_block(inode, logical)
+
+        unsigned = self.sb.flags & EXT2_FLAGS_UNSIGNED_HASH
+        try:
+            leafs = find_leaf_blocks(name.encode(), read_block,
+                                     self.sb.hash_seed, unsigned)
+            return [read_block(leaf) for leaf in leafs]
+        except (ValueError, AssertionError, struct.error):
+            return None
+
+    def __follow_symlink(self, inode_no, path):
+        '''Return inode number of symlink target, if inode is symlink.
+        path -> path to directory containing symlink.'''
+        inode = self.open_inode(inode_no)
+        if inode.mode & S_IFLNK != S_IFLNK:
+            return inode_no
+        real_path = self.__read_symlink(inode)
+        if not real_path.startswith('/'):
+            real_path = os.path.join(path, real_path)
+        return self.resolve_path(real_path)[0]
 
     def open_descriptor(self, descriptor, encoding=None):
         '''Open file or directory as FileSystemInfo by its descriptor.'''
@@ -70,13 +205,18 @@ class FileSystem:
     def __open_entry(self, inode_no, name, path, encoding=None):
         '''Open directory entry directly (without checking path)'''
         inode = self.open_inode(inode_no)
-        try:
-            data = self.extract_file_bytes(inode)
-        except AssertionError:
-            data = [b'']
+
+        def read_data(read=self.extract_file_bytes):
+            try:
+                return read(inode)
+            except AssertionError:
+                return [b'']
+
+        def read_blocks():
+            return read_data(self.read_file_blocks)
 
         if inode.mode & S_IFLNK == S_IFLNK:
-            return self.__open_symlink(inode, data, path, name, encoding)
+            return self.__open_symlink(inode, path, name, encoding)
 
         path = os.path.join(path, name)
         decode = None if encoding is None else lambda x: x.decode(encoding)
@@ -84,19 +224,32 @@ class FileSystem:
         def open_entry(inode, name, path):
             return self.__open_entry(inode, name, path)
 
+        def lookup(name):
+            return self.lookup(inode_no, name)
+
         if inode.mode & S_IFDIR:
-            return DirectoryInfo(data, inode, inode_no, path, open_entry)
-        return FileInfo(data, inode, inode_no, path, decode)
+            return DirectoryInfo(read_blocks, inode, inode_no, path,
+                                 open_entry, lookup, self.open_inode)
+
+        def open_reader():
+            return self.open_reader(inode, path)
+
+        return FileInfo(read_data, inode, inode_no, path, decode,
+                        open_reader)
 
-    def __open_symlink(self, inode, data, path, name, encoding):
+    def __open_symlink(self, inode, path, name, encoding):
         '''Create fileinfo with path to symlink but resolved content'''
-        real_path = del_trailing_zeros(b''.join(data)).decode()
+        real_path = self.__read_symlink(inode)
         if not real_path.startswith('/'):
             real_path = os.path.join(path, real_path)
         fsinfo = self.open(real_path, encoding)
         fsinfo.path = os.path.join(path, name)
         return fsinfo
 
+    def __read_symlink(self, inode):
+        '''Return path where symlink points to.'''
+        return b''.join(self.extract_file_bytes(inode)).decode()
+
     def read(self, start, length):
         '''Read [length] bytes with offset [start] from self.image.'''
         return self.image[start:start+length]
@@ -108,7 +261,18 @@ class FileSystem:
             yield self.image[start:start+self.sb.block_size]
 
     def open_inode(self, index):
-        '''Find and open inode with specified index.'''
+        '''Find and open inode with specified index.
+        Decoded inodes are cached, so returned inode is shared between
+        callers and should not be modified.
+        '''
+        inode = self.inodes.get(index)
+        if inode is None:
+            inode = self.read_inode(index)
+            self.inodes.put(index, inode)
+        return inode
+
+    def read_inode(self, index):
+        '''Read and decode inode with specified index bypassing cache.'''
         start = self.find_inode_addr(index)
         data = self.read(start, self.sb.inode_size)
         return Inode(padded_with_zeroes(data, INODE_SIZE))
@@ -117,40 +281,153 @@ class FileSystem:
         '''Find address of inode with specified index.'''
         group_index = (index - 1) // self.sb.inodes_per_group
         inode_index = (index - 1) % self.sb.inodes_per_group
-        desc = self.open_group_desc(group_index)
-        table_offset = desc.inode_table * self.sb.block_size
+        table_offset = self.gdt.inode_table[group_index] * self.sb.block_size
         inode_offset = inode_index * self.sb.inode_size
         return table_offset + inode_offset
 
     def open_group_desc(self, index):
         '''Find and open group descriptor with specified index.'''
-        table = max(GROUP_0_PADDING + SUPERBLOCK_SIZE, self.sb.block_size)
-        start = table + self.desc_size * index
+        start = self.__group_desc_table_offset() + self.desc_size * index
         return GroupDescriptor(self.read(start, self.desc_size))
 
-    def extract_file_bytes(self, inode):
-        '''Find blocks where inode points and return iterable file bytes.'''
+    def read_file_block(self, inode, logical):
+        '''Read block with in-file index [logical] of file.'''
+        extent_map = self.extent_map(inode)
+        index = extent_map.find(logical)
+        if index == -1:
+            raise ValueError('Block {} is not mapped.'.format(logical))
+        offset = logical - extent_map.logical[index]
+        return next(self.read_blocks(extent_map.physical[index] + offset))
+
+    def open_reader(self, inode, name=None):
+        '''Return raw random-access reader of file content.'''
+        if self.__has_inline_data(inode):
+            reader = io.BytesIO(inode.block[:inode.size])
+            reader.name = name
+            return reader
+        return ExtentReader(self.image, self.extent_map(inode),
+                            self.sb.block_size, inode.size, name)
+
+    def extent_map(self, inode):
+        '''Return ExtentMap of file described by inode.
+        Maps are cached by root of extent tree stored in inode.block, so
+        the same map is shared by inode and its copies found in journal.'''
+        extent_map = self.extent_maps.get(inode.block)
+        if extent_map is None:
+            leafs = self.__find_extent_leafs(Extent(inode.block))
+            extent_map = ExtentMap(leafs)
+            self.extent_maps.put(inode.block, extent_map)
+        return extent_map
+
+    def __has_inline_data(self, inode):
+        '''True if file content is stored right in inode.block'''
         if self.sb.feature_incompat & INCOMPAT_INLINE_DATA and \
-                inode.flags & EXT4_INLINE_DATA_FL or \
-                inode.mode & S_IFLNK == S_IFLNK:
+                inode.flags & EXT4_INLINE_DATA_FL:
+            return True
+        # fast symlinks store target path in inode.block
+        return inode.mode & S_IFLNK == S_IFLNK and \
+            not inode.flags & EXT4_EXTENTS_FL
+
+    def extract_file_bytes(self, inode):
+        '''Find blocks where inode points and return iterable file bytes.
+        Content is bounded by inode.size, each contiguous run is read at
+        once, holes and uninitialized extents are yielded as zeros.'''
+        if self.__has_inline_data(inode):
+            return [inode.block[:inode.size]]
+        return self.__read_segments(self.read_segments(inode))
+
+    def __read_segments(self, segments):
+        '''Yields bytes of each segment, zero segments are yielded lazily
+        by chunks.'''
+        block_size = self.sb.block_size
+        for physical, count in segments:
+            if physical is None:
+                yield from iter_zeros(count)
+            else:
+                yield self.read(physical * block_size, count)
+
+    def copy_file(self, inode, out_fd, digest=None):
+        '''Write file content to file descriptor out_fd without building it
+        in memory. Holes and uninitialized extents become holes of output.
+        If digest (hashlib object) is given, it is updated with content
+        while it is written. Returns count of bytes of content.'''
+        if self.__has_inline_data(inode):
+            data = inode.block[:inode.size]
+            if digest is not None:
+                digest.update(data)
+            return os.write(out_fd, data)
+        return copy_segments(out_fd, self.image_file.fileno(), self.image,
+                             self.read_segments(inode), self.sb.block_size,
+                             digest)
+
+    def read_file_blocks(self, inode):
+        '''Same as extract_file_bytes, but yields file bytes block by block,
+        so only one block at a time is copied.'''
+        if self.__has_inline_data(inode):
             return [inode.block]
-        else:
-            return (block
-                    for start, length
-                    in self.read_extent_blocks(Extent(inode.block))
-                    for block
-                    in self.read_blocks(start, length))
+        return (block
+                for _, start, length, _ in self.extent_map(inode).runs()
+                for block
+                in self.read_blocks(start, length))
+
+    def read_runs(self, inode):
+        '''Yields one memoryview of image per contiguous run of file blocks
+        without copying. Content is bounded by inode.size, holes and
+        uninitialized extents are yielded as views of zeros.
+        Views should be released before fs is closed.'''
+        if self.__has_inline_data(inode):
+            yield memoryview(inode.block[:inode.size])
+            return
+        block_size = self.sb.block_size
+        segments = self.read_segments(inode)
+        with memoryview(self.image) as image:
+            for physical, count in segments:
+                if physical is None:
+                    yield from map(memoryview, iter_zeros(count))
+                else:
+                    start = physical * block_size
+                    yield image[start:start+count]
+
+    def read_segments(self, inode):
+        '''Return list of pairs (physical block or None, bytes count) which
+        cover file content up to inode.size. None marks zero segments.'''
+        extent_map = self.extent_map(inode)
+        return list(extent_map.segments(self.sb.block_size, inode.size))
+
+    def data_fingerprint(self, inode):
+        '''Return digest of file size and location of its content (or
+        inline content itself). Inodes with equal fingerprints have the same
+        content, so it is found without reading data blocks.'''
+        digest = hashlib.sha1(SIZE_STRUCT.pack(inode.size))
+        if self.__has_inline_data(inode):
+            digest.update(inode.block[:inode.size])
+            return digest.digest()
+        for physical, count in self.read_segments(inode):
+            digest.update(SEGMENT_STRUCT.pack(
+                SEGMENT_HOLE if physical is None else physical, count))
+        return digest.digest()
+
+    def physical_runs(self, inode):
+        '''Return list of pairs (start block, blocks count) of disk blocks
+        which store file content up to inode.size. Holes, uninitialized
+        extents and inline data have no blocks.'''
+        if self.__has_inline_data(inode):
+            return []
+        block_size = self.sb.block_size
+        return [(physical, ceil(count / block_size))
+                for physical, count in self.read_segments(inode)
+                if physical is not None]
 
     def read_extent_blocks(self, extent):
         '''Return iterable sequence of pairs, where first element is block
         number where file bytes are stored, second element is count of
-        blocks in this segment.
+        blocks in this segment. Physically adjacent extents are merged
+        into one segment.
         Sequence is already sorted by in-file blocks order.
         I.e., [(start, length), (start, length), ...]
         '''
-        leafs = self.__find_extent_leafs(extent)
-        leafs.sort(key=lambda e: e.block)
-        return ((x.start, x.length) for x in leafs)
+        extent_map = ExtentMap(self.__find_extent_leafs(extent))
+        return ((start, length) for _, start, length, _ in extent_map.runs())
 
     def __find_extent_leafs(self, extent):
         '''Runs recursively through extent tree and collects leafs.'''
@@ -166,6 +443,39 @@ class FileSystem:
     def journal(self):
         if not hasattr(self, '_journal'):
             journal_inode = self.open_inode(self.sb.journal_inum)
-            journal_bytes = b''.join(self.extract_file_bytes(journal_inode))
-            self._journal = Journal(journal_bytes)
+            self._journal = Journal(self.image,
+                                    self.extent_map(journal_inode),
+                                    self.sb.block_size)
         return self._journal
+
+    def journal_map(self, full_sweep=False, jobs=1, index_path=None,
+                    image_path=None):
+        '''Return JournalMap of journal, see Journal.create_journal_map.
+        If index_path is given, map is loaded from index file there when it
+        was built for the same state of filesystem and journal; otherwise
+        map is built and saved to index_path (errors of saving are ignored,
+        image may be on read-only media).
+        image_path -> path by which scan workers open image (if jobs > 1),
+        name of image file by default.'''
+        signature = journal_map_signature(self.sb, self.journal.sb,
+                                          full_sweep)
+        if index_path is not None:
+            journal_map = read_journal_map(index_path, signature)
+            if journal_map is not None:
+                return journal_map
+
+        if image_path is None:
+            image_path = self.image_file.name
+        journal_map = self.journal.create_journal_map(full_sweep, jobs,
+                                                      image_path)
+        if index_path is not None:
+            try:
+                write_journal_map(index_path, journal_map, signature)
+            except OSError:
+                pass
+        return journal_map
+
+
+def sizeof_inode(inode):
+    '''Estimated memory used by decoded inode.'''
+    return sys.getsizeof(inode) + sys.getsizeof(inode.block)
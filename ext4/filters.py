@@ -0,0 +1,109 @@
+'''Filters of deleted files to restore.
+Filter is checked in order of cost: dtime of deleted inode before its
+copies are searched in journal, metadata of copy before its extent tree
+is read, and magic signature last, by reading start of the first run of
+data. Rejected candidates are never extracted.
+'''
+
+import time
+from datetime import datetime
+
+from ext4.consts import S_IFIFO, S_IFCHR, S_IFDIR, S_IFBLK, S_IFREG, \
+                        S_IFLNK, S_IFSOCK
+
+
+S_IFMT = 0xF000
+
+FILE_TYPES = {
+    'file': S_IFREG,
+    'dir': S_IFDIR,
+    'symlink': S_IFLNK,
+    'fifo': S_IFIFO,
+    'socket': S_IFSOCK,
+    'char': S_IFCHR,
+    'block': S_IFBLK,
+}
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def in_range(value, bounds):
+    '''True if value is in inclusive range bounds = (min, max),
+    None bounds or None ends are open.'''
+    if bounds is None:
+        return True
+    low, high = bounds
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def parse_size(text):
+    '''Parse size in bytes with optional binary suffix: 1500, 64K, 1M.'''
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ''
+    return int(text[:len(text) - len(unit)]) * SIZE_UNITS[unit]
+
+
+def parse_time(text, now=None):
+    '''Parse point of time into unix timestamp. Accepts timestamp
+    (1500000000), ISO date and time (2017-07-14 02:40) and age relative
+    to now (90m, 2h, 3d).'''
+    text = text.strip()
+    if text[-1:] in TIME_UNITS and text[:-1].isdigit():
+        now = time.time() if now is None else now
+        return int(now) - int(text[:-1]) * TIME_UNITS[text[-1]]
+    if text.isdigit():
+        return int(text)
+    return int(datetime.fromisoformat(text).timestamp())
+
+
+class RestoreFilter:
+    '''Conditions on restored files, all given conditions must hold.
+    :param dtime: range (min, max) of deletion time, None is open end
+    :param mtime: range of modification time of journal copy of inode
+    :param size: range of file size in bytes
+    :param uid, gid: owner and group of file
+    :param file_type: S_IF* file type or name from FILE_TYPES
+    :param magic: sequence of signatures (bytes), content must start with
+                  one of them at magic_offset
+    '''
+    def __init__(self, dtime=None, mtime=None, size=None, uid=None, gid=None,
+                 file_type=None, magic=(), magic_offset=0):
+        self.dtime = dtime
+        self.mtime = mtime
+        self.size = size
+        self.uid = uid
+        self.gid = gid
+        self.file_type = FILE_TYPES.get(file_type, file_type)
+        self.magic = tuple(magic)
+        self.magic_offset = magic_offset
+
+    def match_deleted(self, dtime):
+        '''Check deleted inode, only its dtime is known at this point.'''
+        return in_range(dtime, self.dtime)
+
+    def match_inode(self, inode):
+        '''Check metadata of inode, no blocks are read.'''
+        if not in_range(inode.mtime, self.mtime) or \
+                not in_range(inode.size, self.size):
+            return False
+        if self.uid is not None and inode.uid != self.uid:
+            return False
+        if self.gid is not None and inode.gid != self.gid:
+            return False
+        return self.file_type is None or \
+            inode.mode & S_IFMT == self.file_type
+
+    def match_data(self, fs, inode):
+        '''Check magic signature. Only the first run of content is touched
+        and only its first bytes are read.'''
+        if not self.magic:
+            return True
+        end = self.magic_offset + max(map(len, self.magic))
+        runs = fs.read_runs(inode)
+        try:
+            with next(runs, memoryview(b'')) as run:
+                head = bytes(run[self.magic_offset:end])
+        finally:
+            runs.close()
+        return head.startswith(self.magic)
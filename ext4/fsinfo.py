@@ -1,10 +1,10 @@
+import io
 import os
-from itertools import tee
 
 from ext4.structs import DirectoryEntry
-from ext4.consts import DIR_ENTRY_HEADER_SIZE
-from ext4.utils import format_file_mode, del_trailing_zeros, \
-                       running_windows
+from ext4.consts import DIR_ENTRY_HEADER_SIZE, S_IFDIR, S_IFREG, S_IFLNK, \
+                        FileType
+from ext4.utils import format_file_mode, running_windows
 
 
 if not running_windows():
@@ -32,19 +32,8 @@ class FileSystemInfo:
         self.creation_time = inode.crtime
         self.extended_attrs = inode.file_acl
 
-        if running_windows():
-            self.owner = inode.uid
-            self.group = inode.gid
-            return
-
-        try:
-            self.owner = pwd.getpwuid(self.uid).pw_name
-        except KeyError:
-            self.owner = inode.uid
-        try:
-            self.group = grp.getgrgid(self.gid).gr_name
-        except KeyError:
-            self.group = inode.gid
+        self.owner = get_owner(inode.uid)
+        self.group = get_group(inode.gid)
 
     @property
     def path(self):
@@ -62,14 +51,106 @@ class FileSystemInfo:
         pass
 
 
+def get_owner(uid):
+    '''Name of user with uid, or uid itself if it is unknown.'''
+    if running_windows():
+        return uid
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return uid
+
+
+def get_group(gid):
+    '''Name of group with gid, or gid itself if it is unknown.'''
+    if running_windows():
+        return gid
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return gid
+
+
+# Attributes of DirEntry which are read from inode, and how to get them.
+INODE_ATTRS = {
+    'mode': lambda inode: inode.mode,
+    'blocks': lambda inode: inode.blocks,
+    'links': lambda inode: inode.links_count,
+    'mode_str': lambda inode: format_file_mode(inode.mode),
+    'size': lambda inode: inode.size,
+    'uid': lambda inode: inode.uid,
+    'gid': lambda inode: inode.gid,
+    'access_time': lambda inode: inode.atime,
+    'mod_time': lambda inode: inode.mtime,
+    'change_time': lambda inode: inode.ctime,
+    'creation_time': lambda inode: inode.crtime,
+    'extended_attrs': lambda inode: inode.file_acl,
+    'owner': lambda inode: get_owner(inode.uid),
+    'group': lambda inode: get_group(inode.gid),
+}
+
+
+class DirEntry:
+    '''Lightweight directory entry yielded by DirectoryInfo.scandir().
+    Name, inode number and file type are taken from directory entry
+    without any I/O. Attributes of FileSystemInfo, like size or mod_time,
+    are read from inode on first access.
+    '''
+    def __init__(self, entry, dir_path, open_inode):
+        ''' open_inode(inode number) -> ext4.structs.Inode '''
+        self.name = entry.name
+        self.inode_no = entry.inode
+        self.file_type = entry.file_type
+        self.path = os.path.join(dir_path, entry.name)
+        self.__open_inode = open_inode
+        self.__inode = None
+
+    @property
+    def inode(self):
+        if self.__inode is None:
+            self.__inode = self.__open_inode(self.inode_no)
+        return self.__inode
+
+    def __getattr__(self, attr):
+        if attr not in INODE_ATTRS:
+            raise AttributeError(attr)
+        value = INODE_ATTRS[attr](self.inode)
+        setattr(self, attr, value)
+        return value
+
+    def is_dir(self):
+        return self.__is(FileType.directory, S_IFDIR)
+
+    def is_file(self):
+        return self.__is(FileType.regular, S_IFREG)
+
+    def is_symlink(self):
+        return self.__is(FileType.symlink, S_IFLNK)
+
+    def __is(self, file_type, mode):
+        '''Check file type by dirent, or by inode if dirent has no type.'''
+        if self.file_type != FileType.unknown:
+            return self.file_type == file_type
+        return self.mode & 0xF000 == mode
+
+    def __str__(self):
+        return "<DirEntry: {path}>".format(path=self.path)
+
+
 class DirectoryInfo(FileSystemInfo):
     '''Ext4 directory. It contains set of ext4.structs.DirectoryEntry.'''
-    def __init__(self, data, inode, inode_no, path, open_entry):
-        ''' open_entry(DirectoryEntry) -> FileInfo/DirectoryInfo '''
+    def __init__(self, read_blocks, inode, inode_no, path, open_entry,
+                 lookup=None, open_inode=None):
+        ''' read_blocks() -> new iterable of directory blocks
+        open_entry(DirectoryEntry) -> FileInfo/DirectoryInfo
+        lookup(name) -> inode number of entry or 0 if there is no entry.
+        open_inode(inode number) -> ext4.structs.Inode
+        '''
         super().__init__(inode, path, inode_no)
-        self.__data_origin, self.__data = tee(data)
-        self.__block = next(self.__data)
-        self.__start = 0
+        self.__lookup = lookup
+        self.__open_inode = open_inode
+        self.__read_blocks = read_blocks
+        self.__entries = None
         self.__open_entry = open_entry
 
     def get_all(self):
@@ -87,37 +168,31 @@ class DirectoryInfo(FileSystemInfo):
                 if isinstance(x, DirectoryInfo)]
 
     def get_entries(self):
-        '''Get all directory entries'''
+        '''Get generator of all directory entries'''
         return self.__read_entries()
 
+    def scandir(self):
+        '''Yields DirEntry for each entry of this directory. Unlike other
+        methods it does not open entries, inode of entry is read only if
+        inode-backed attribute of DirEntry is accessed.'''
+        return (DirEntry(e, self.path, self.__open_inode)
+                for e in self.__read_entries())
+
     def __getitem__(self, item):
         '''Get item from directory by filename'''
-        items = [x for x in self.get_entries() if x.name == item]
-        if len(items) >= 1:
-            e = items[0]
-            return self.__open_entry(e.inode, e.name, self.path)
+        if self.__lookup is not None:
+            inode_no = self.__lookup(item)
+        else:
+            inode_no = next((x.inode for x in self.get_entries()
+                             if x.name == item), 0)
+        if inode_no:
+            return self.__open_entry(inode_no, item, self.path)
         raise FileNotFoundError('{} not found'.format(item))
 
     def __read_entries(self):
-        '''Returns generator of FileSystemInfos.'''
-        self.__data_origin, data = tee(self.__data_origin)
-
-        entries = []
-        for block in data:
-            start = 0
-            while start < len(block):
-                entry = self.__parse_entry(block, start)
-                start += entry.rec_len
-                entries.append(entry)
-
-        return entries
-
-    def __parse_entry(self, data, start):
-        '''Parse DirectoryEntry struct beginning at [start] from [data].'''
-        header_end = start + DIR_ENTRY_HEADER_SIZE
-        entry = DirectoryEntry(data[start:header_end])
-        entry.name = data[header_end:header_end+entry.name_len].decode()
-        return entry
+        '''Returns generator of DirectoryEntries. Blocks are re-read on
+        each call and only one block at a time is kept in memory.'''
+        return read_entries(self.__read_blocks())
 
     def __create_fsinfo(self, entries):
         '''Returns generator to make fsinfo from each entry'''
@@ -127,33 +202,57 @@ class DirectoryInfo(FileSystemInfo):
         return self
 
     def __next__(self):
-        if self.__start == len(self.__block):
-            try:
-                self.__block = next(self.__data)
-            except StopIteration:
-                raise
-            self.__start = 0
-        entry = self.__parse_entry(self.__block, self.__start)
-        self.__start += entry.rec_len
-        return self.__open_entry(entry.inode, entry.name, self.path)
+        if self.__entries is None:
+            self.__entries = self.__create_fsinfo(self.__read_entries())
+        return next(self.__entries)
 
     def __str__(self):
         return "<DirectoryInfo: {path}>".format(path=self.path)
 
 
+def read_entries(blocks):
+    '''Yields DirectoryEntries from each of directory blocks.
+    Unused entries (with zero inode) are skipped.'''
+    for block in blocks:
+        start = 0
+        while start < len(block):
+            entry = parse_entry(block, start)
+            start += entry.rec_len
+            if entry.inode:
+                yield entry
+
+
+def parse_entry(data, start):
+    '''Parse DirectoryEntry struct beginning at [start] from [data].'''
+    header_end = start + DIR_ENTRY_HEADER_SIZE
+    entry = DirectoryEntry(data[start:header_end])
+    entry.name = data[header_end:header_end+entry.name_len].decode()
+    return entry
+
+
 class FileInfo(FileSystemInfo):
-    def __init__(self, data, inode, inode_no, path, decode=None):
+    def __init__(self, read_data, inode, inode_no, path, decode=None,
+                 open_reader=None):
+        ''' read_data() -> new iterable of file content chunks, bounded by
+        file size.
+        open_reader() -> raw io reader of file content '''
         super().__init__(inode, path, inode_no)
-        self.__data_origin, _ = tee(data)
+        self.__read_data = read_data
         self.__decode = decode
+        self.__open_reader = open_reader
+
+    def open(self, buffer_size=io.DEFAULT_BUFFER_SIZE):
+        '''Open file content as seekable binary stream.
+        Supports seek, read(n) and readinto(buffer). Only blocks which are
+        actually read are touched.'''
+        return io.BufferedReader(self.__open_reader(), buffer_size)
 
     def __iter__(self):
-        self.__data_origin, data = tee(self.__data_origin)
+        data = self.__read_data()
         if self.__decode is not None:
             return (line for block in data
-                    for line
-                    in self.__decode(del_trailing_zeros(block)).split('\n'))
-        return (del_trailing_zeros(block) for block in data)
+                    for line in self.__decode(block).split('\n'))
+        return iter(data)
 
     def set_encoding(self, encoding):
         self.__decode = lambda x: x.decode(encoding)
@@ -162,8 +261,7 @@ class FileInfo(FileSystemInfo):
         self.__decode = None
 
     def read(self):
-        self.__data_origin, data = tee(self.__data_origin)
-        content = del_trailing_zeros(b''.join(data))
+        content = b''.join(self.__read_data())
         if self.__decode is not None:
             return self.__decode(content)
         else:
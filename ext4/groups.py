@@ -0,0 +1,59 @@
+import struct
+from array import array
+
+
+# Unsigned layouts of the 32 and 64 bytes group descriptors,
+# see ext4.structs.GroupDescriptor for field names.
+DESC_32_FORMAT = '<3I4HI4H'
+DESC_64_FORMAT = DESC_32_FORMAT + '3I4HI2H4x'
+
+
+class GroupDescriptorTable:
+    '''Whole group descriptor table decoded once into compact array-backed
+    columns. Each column is indexed by block group number, so lookups
+    like gdt.inode_table[group] cost nothing more than array indexing.
+    :param data: descriptors_count * desc_size bytes
+    '''
+    def __init__(self, data, desc_size, is64):
+        self.desc_size = desc_size
+        self.is64 = is64
+        self.block_bitmap = array('Q')
+        self.inode_bitmap = array('Q')
+        self.inode_table = array('Q')
+        self.free_blocks_count = array('I')
+        self.free_inodes_count = array('I')
+        self.used_dirs_count = array('I')
+        self.itable_unused = array('I')
+        self.flags = array('H')
+
+        if is64:
+            self.__load_64(data)
+        else:
+            self.__load_32(data)
+
+    def __len__(self):
+        return len(self.inode_table)
+
+    def __load_32(self, data):
+        layout = DESC_32_FORMAT + 'x' * (self.desc_size - 32)
+        for desc in struct.iter_unpack(layout, data):
+            self.block_bitmap.append(desc[0])
+            self.inode_bitmap.append(desc[1])
+            self.inode_table.append(desc[2])
+            self.free_blocks_count.append(desc[3])
+            self.free_inodes_count.append(desc[4])
+            self.used_dirs_count.append(desc[5])
+            self.flags.append(desc[6])
+            self.itable_unused.append(desc[10])
+
+    def __load_64(self, data):
+        layout = DESC_64_FORMAT + 'x' * (self.desc_size - 64)
+        for desc in struct.iter_unpack(layout, data):
+            self.block_bitmap.append(desc[0] | desc[12] << 32)
+            self.inode_bitmap.append(desc[1] | desc[13] << 32)
+            self.inode_table.append(desc[2] | desc[14] << 32)
+            self.free_blocks_count.append(desc[3] | desc[15] << 16)
+            self.free_inodes_count.append(desc[4] | desc[16] << 16)
+            self.used_dirs_count.append(desc[5] | desc[17] << 16)
+            self.flags.append(desc[6])
+            self.itable_unused.append(desc[10] | desc[18] << 16)
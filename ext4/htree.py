@@ -0,0 +1,184 @@
+'''Hashed B-tree (dir_index) directories.
+See "Hash Tree Directories" at
+https://ext4.wiki.kernel.org/index.php/Ext4_Disk_Layout
+and fs/ext4/hash.c in the kernel for hash functions.
+'''
+
+import struct
+from bisect import bisect_right
+
+from ext4.consts import *
+
+
+MASK = 0xFFFFFFFF
+DEFAULT_SEED = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476)
+HTREE_EOF_32BIT = 0x7FFFFFFF
+TEA_DELTA = 0x9E3779B9
+HALF_MD4_K2 = 0o13240474631
+HALF_MD4_K3 = 0o15666365641
+
+DX_ROOT_INFO_OFFSET = 24
+DX_NODE_OFFSET = 8
+
+# reserved_zero, hash_version, info_length, indirect_levels, unused_flags
+DX_ROOT_INFO = struct.Struct('<IBBBB')
+# limit, count, block of the first entry
+DX_COUNT_LIMIT = struct.Struct('<HHI')
+# hash, block
+DX_ENTRY = struct.Struct('<II')
+
+
+def dirhash(name, hash_version, seed=None):
+    '''Compute major hash of name (bytes) the same way as ext4 does.'''
+    if seed is None or not any(seed):
+        seed = DEFAULT_SEED
+    buf = [x & MASK for x in seed]
+    signed = hash_version < DX_HASH_LEGACY_UNSIGNED
+
+    if hash_version in (DX_HASH_LEGACY, DX_HASH_LEGACY_UNSIGNED):
+        major = _dx_hack_hash(name, signed)
+    elif hash_version in (DX_HASH_HALF_MD4, DX_HASH_HALF_MD4_UNSIGNED):
+        for start in range(0, len(name), 32):
+            _half_md4_transform(buf, _str2hashbuf(name[start:], 8, signed))
+        major = buf[1]
+    elif hash_version in (DX_HASH_TEA, DX_HASH_TEA_UNSIGNED):
+        for start in range(0, len(name), 16):
+            _tea_transform(buf, _str2hashbuf(name[start:], 4, signed))
+        major = buf[0]
+    else:
+        raise ValueError('Unknown hash version: {}'.format(hash_version))
+
+    major &= ~1 & MASK
+    if major == HTREE_EOF_32BIT << 1:
+        major = (HTREE_EOF_32BIT - 1) << 1
+    return major
+
+
+def _char(byte, signed):
+    return byte - 256 if signed and byte > 127 else byte
+
+
+def _dx_hack_hash(name, signed):
+    hash0, hash1 = 0x12a3fe2d, 0x37abe8f9
+    for byte in name:
+        value = (hash1 + (hash0 ^ (_char(byte, signed) * 7152373))) & MASK
+        if value & 0x80000000:
+            value = (value - 0x7fffffff) & MASK
+        hash1, hash0 = hash0, value
+    return (hash0 << 1) & MASK
+
+
+def _str2hashbuf(msg, num, signed):
+    '''Pack first num * 4 bytes of msg into list of num words.'''
+    length = len(msg)
+    pad = (length | (length << 8)) & MASK
+    pad = (pad | (pad << 16)) & MASK
+
+    words = []
+    value = pad
+    for index, byte in enumerate(msg[:num * 4]):
+        value = (_char(byte, signed) + (value << 8)) & MASK
+        if index % 4 == 3:
+            words.append(value)
+            value = pad
+    if len(words) < num:
+        words.append(value)
+    words.extend([pad] * (num - len(words)))
+    return words
+
+
+def _rol32(value, shift):
+    return ((value << shift) | (value >> (32 - shift))) & MASK
+
+
+def _half_md4_transform(buf, words):
+    f = lambda x, y, z: z ^ (x & (y ^ z))
+    g = lambda x, y, z: (x & y) + ((x ^ y) & z)
+    h = lambda x, y, z: x ^ y ^ z
+    a, b, c, d = buf
+
+    def rnd(func, a, b, c, d, x, shift):
+        return _rol32((a + func(b, c, d) + x) & MASK, shift)
+
+    for i0, i1, i2, i3 in ((0, 1, 2, 3), (4, 5, 6, 7)):
+        a = rnd(f, a, b, c, d, words[i0], 3)
+        d = rnd(f, d, a, b, c, words[i1], 7)
+        c = rnd(f, c, d, a, b, words[i2], 11)
+        b = rnd(f, b, c, d, a, words[i3], 19)
+
+    for i0, i1, i2, i3 in ((1, 3, 5, 7), (0, 2, 4, 6)):
+        a = rnd(g, a, b, c, d, words[i0] + HALF_MD4_K2, 3)
+        d = rnd(g, d, a, b, c, words[i1] + HALF_MD4_K2, 5)
+        c = rnd(g, c, d, a, b, words[i2] + HALF_MD4_K2, 9)
+        b = rnd(g, b, c, d, a, words[i3] + HALF_MD4_K2, 13)
+
+    for i0, i1, i2, i3 in ((3, 7, 2, 6), (1, 5, 0, 4)):
+        a = rnd(h, a, b, c, d, words[i0] + HALF_MD4_K3, 3)
+        d = rnd(h, d, a, b, c, words[i1] + HALF_MD4_K3, 9)
+        c = rnd(h, c, d, a, b, words[i2] + HALF_MD4_K3, 11)
+        b = rnd(h, b, c, d, a, words[i3] + HALF_MD4_K3, 15)
+
+    buf[0] = (buf[0] + a) & MASK
+    buf[1] = (buf[1] + b) & MASK
+    buf[2] = (buf[2] + c) & MASK
+    buf[3] = (buf[3] + d) & MASK
+
+
+def _tea_transform(buf, words):
+    total = 0
+    b0, b1 = buf[0], buf[1]
+    a, b, c, d = words
+    for _ in range(16):
+        total = (total + TEA_DELTA) & MASK
+        b0 = (b0 + ((((b1 << 4) + a) & MASK) ^ ((b1 + total) & MASK) ^
+                    (((b1 >> 5) + b) & MASK))) & MASK
+        b1 = (b1 + ((((b0 << 4) + c) & MASK) ^ ((b0 + total) & MASK) ^
+                    (((b0 >> 5) + d) & MASK))) & MASK
+    buf[0] = (buf[0] + b0) & MASK
+    buf[1] = (buf[1] + b1) & MASK
+
+
+def read_dx_entries(block, offset):
+    '''Return pair of lists (hashes, blocks) of dx_entries stored in
+    dx_root or dx_node block starting at offset.'''
+    limit, count, first = DX_COUNT_LIMIT.unpack_from(block, offset)
+    if count == 0 or count > limit:
+        raise ValueError('Corrupted htree node.')
+    hashes, blocks = [0], [first]
+    start = offset + DX_ENTRY.size
+    for hash_, leaf in DX_ENTRY.iter_unpack(block[start:start +
+                                                  DX_ENTRY.size * (count - 1)]):
+        hashes.append(hash_)
+        blocks.append(leaf)
+    return hashes, blocks
+
+
+def find_leaf_blocks(name, read_block, seed, unsigned_hash):
+    '''Walk from dx_root through dx_nodes and yield logical numbers of
+    leaf blocks which may contain entry with name (bytes).
+    Usually it is one block, next ones are yielded only if entries with
+    the same hash continue in them.
+    read_block(logical block number) -> bytes of directory block
+    '''
+    root = read_block(0)
+    _, hash_version, info_length, levels, _ = \
+        DX_ROOT_INFO.unpack_from(root, DX_ROOT_INFO_OFFSET)
+    if hash_version <= DX_HASH_TEA and unsigned_hash:
+        hash_version += DX_HASH_LEGACY_UNSIGNED
+    target = dirhash(name, hash_version, seed)
+
+    node, offset = root, DX_ROOT_INFO_OFFSET + info_length
+    for _ in range(levels):
+        hashes, blocks = read_dx_entries(node, offset)
+        index = bisect_right(hashes, target) - 1
+        node, offset = read_block(blocks[index]), DX_NODE_OFFSET
+
+    hashes, blocks = read_dx_entries(node, offset)
+    index = bisect_right(hashes, target) - 1
+    yield blocks[index]
+
+    # entries with colliding hashes may be continued in next leafs
+    for hash_, leaf in zip(hashes[index + 1:], blocks[index + 1:]):
+        if (hash_ & ~1) != target:
+            break
+        yield leaf
@@ -0,0 +1,184 @@
+'''Map of filesystem blocks to their copies stored in journal.
+Map is kept in three flat arrays: sorted filesystem block numbers, offsets
+of their copies and journal block numbers of copies, so it is compact and
+lookup is a binary search. It is built by one sort of all copies: with
+NumPy by lexsort, otherwise by sort of integer keys packing all fields.
+'''
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MASK32 = 0xFFFFFFFF
+AGE_BIAS = 1 << 31
+
+INDEX_SUFFIX = '.jmap'
+INDEX_MAGIC = b'PYEXTJMP'
+INDEX_VERSION = 1
+# magic, version, signature (see journal_map_signature), count of blocks
+# and count of copies; header is padded to keep columns aligned, columns
+# follow it in little-endian byte order
+INDEX_HEADER = struct.Struct('<8sI16siqiiB3xQQ4x')
+
+
+class JournalMap(Mapping):
+    '''Read-only mapping {filesystem block -> [journal blocks]}, where
+    copies are ordered by actuality, most recent copy first.
+    :param blocks: sorted filesystem block numbers
+    :param offsets: copies of blocks[i] are copies[offsets[i]:offsets[i+1]]
+    :param copies: journal block numbers
+    '''
+    def __init__(self, blocks=None, offsets=None, copies=None):
+        self.blocks = array('Q') if blocks is None else blocks
+        self.offsets = array('Q', [0]) if offsets is None else offsets
+        self.copies = array('I') if copies is None else copies
+
+    def __find(self, block):
+        index = bisect_left(self.blocks, block)
+        if index < len(self.blocks) and self.blocks[index] == block:
+            return index
+        return -1
+
+    def __getitem__(self, block):
+        index = self.__find(block)
+        if index == -1:
+            raise KeyError(block)
+        return list(self.copies[self.offsets[index]:self.offsets[index + 1]])
+
+    def __contains__(self, block):
+        return self.__find(block) != -1
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __reduce__(self):
+        # columns may be views of mmapped index, which cannot be pickled
+        return JournalMap, (array('Q', self.blocks),
+                            array('Q', self.offsets),
+                            array('I', self.copies))
+
+
+def build_journal_map(ages, jrn_blocks, disc_blocks):
+    '''Build JournalMap from parallel arrays describing copies: age of
+    transaction (see Journal.age), journal block of copy and filesystem
+    block it is a copy of.'''
+    if not len(disc_blocks):
+        return JournalMap()
+    if numpy is not None:
+        return _build_numpy(ages, jrn_blocks, disc_blocks)
+    return _build_python(ages, jrn_blocks, disc_blocks)
+
+
+def _build_numpy(ages, jrn_blocks, disc_blocks):
+    ages = numpy.asarray(ages, dtype=numpy.int64)
+    jrn_blocks = numpy.asarray(jrn_blocks, dtype=numpy.int64)
+    disc_blocks = numpy.asarray(disc_blocks, dtype=numpy.uint64)
+
+    # last key is primary: block ascending, then newest and latest first
+    order = numpy.lexsort((-jrn_blocks, -ages, disc_blocks))
+    disc_blocks = disc_blocks[order]
+    keys, first = numpy.unique(disc_blocks, return_index=True)
+    offsets = numpy.append(first, len(disc_blocks))
+    copies = jrn_blocks[order]
+    return JournalMap(array('Q', keys.astype(numpy.uint64).tobytes()),
+                      array('Q', offsets.astype(numpy.uint64).tobytes()),
+                      array('I', copies.astype(numpy.uint32).tobytes()))
+
+
+def _build_python(ages, jrn_blocks, disc_blocks):
+    # block ascending, then age and journal block descending
+    packed = sorted((disc << 64) | (MASK32 - (age + AGE_BIAS)) << 32 |
+                    (MASK32 - jrn)
+                    for age, jrn, disc in zip(ages, jrn_blocks, disc_blocks))
+    keys, offsets, copies = array('Q'), array('Q'), array('I')
+    for position, key in enumerate(packed):
+        block = key >> 64
+        if not keys or keys[-1] != block:
+            keys.append(block)
+            offsets.append(position)
+        copies.append(MASK32 - (key & MASK32))
+    offsets.append(len(packed))
+    return JournalMap(keys, offsets, copies)
+
+
+def journal_map_signature(sb, journal_sb, full_sweep=False):
+    '''Values which identify state of filesystem and its journal. Index
+    of journal map is valid only for the same signature.
+    :param sb: ext4.structs.SuperBlock
+    :param journal_sb: ext4.jstructs.JournalSuperBlock
+    '''
+    return (sb.uuid, sb.wtime, sb.kbytes_written, journal_sb.sequence,
+            journal_sb.start, int(bool(full_sweep)))
+
+
+def write_journal_map(path, journal_map, signature):
+    '''Save journal map to index file at path. File is replaced
+    atomically, so concurrent readers never see partial index.'''
+    header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, *signature,
+                               len(journal_map.blocks),
+                               len(journal_map.copies))
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as index:
+            index.write(header)
+            for typecode, column in (('Q', journal_map.blocks),
+                                     ('Q', journal_map.offsets),
+                                     ('I', journal_map.copies)):
+                column = array(typecode, column)
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                index.write(column.tobytes())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def read_journal_map(path, signature):
+    '''Load journal map from index file at path. Columns are views of
+    mmapped file, nothing is copied. Returns None if there is no index or
+    it is broken or was built for other signature.'''
+    try:
+        index = open(path, 'rb')
+    except OSError:
+        return None
+    with index:
+        size = os.fstat(index.fileno()).st_size
+        if size < INDEX_HEADER.size:
+            return None
+        data = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, *stored, blocks_count, copies_count = \
+        INDEX_HEADER.unpack_from(data)
+    expected = INDEX_HEADER.size + 16 * blocks_count + 8 + 4 * copies_count
+    if magic != INDEX_MAGIC or version != INDEX_VERSION or \
+            tuple(stored) != tuple(signature) or size != expected:
+        data.close()
+        return None
+
+    view = memoryview(data)
+    start = INDEX_HEADER.size
+    columns = []
+    for typecode, count in (('Q', blocks_count), ('Q', blocks_count + 1),
+                            ('I', copies_count)):
+        end = start + count * struct.calcsize(typecode)
+        column = view[start:end].cast(typecode)
+        if sys.byteorder == 'big':
+            column = array(typecode, column)
+            column.byteswap()
+        columns.append(column)
+        start = end
+    return JournalMap(*columns)
@@ -1,101 +1,393 @@
-from itertools import chain, groupby
+import multiprocessing
+from array import array
+from math import ceil
 
 from ext4.jstructs import *
-from ext4.utils import chunk
+from ext4.jmap import build_journal_map
+from ext4.utils import crc32c
+
+
+SEQUENCE_MASK = 0xFFFFFFFF
+
+# Journal is split into this many block ranges per scan worker
+RANGES_PER_JOB = 4
+
+# HeaderTable.valid of commit block whose checksum is not verified yet
+COMMIT_UNCHECKED = 2
+
+
+class HeaderTable:
+    '''Header blocks found in journal, decoded into compact parallel arrays
+    ordered by journal block. Payload of header block (filesystem blocks
+    of descriptor tags or of revoke records) is kept in one shared array,
+    see payload(). valid of commit block is COMMIT_UNCHECKED until its
+    checksum is verified by the walk, then zero if checksum is bad.
+    '''
+    def __init__(self):
+        self.index = array('I')
+        self.blocktype = array('B')
+        self.sequence = array('I')
+        self.valid = array('B')
+        self.offsets = array('Q', [0])
+        self.values = array('Q')
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, index, blocktype, sequence, valid=True, values=()):
+        self.index.append(index)
+        self.blocktype.append(blocktype)
+        self.sequence.append(sequence)
+        self.valid.append(valid)
+        self.values.extend(values)
+        self.offsets.append(len(self.values))
+
+    def extend(self, other):
+        '''Append table of the following journal range.'''
+        base = len(self.values)
+        self.index.extend(other.index)
+        self.blocktype.extend(other.blocktype)
+        self.sequence.extend(other.sequence)
+        self.valid.extend(other.valid)
+        self.values.extend(other.values)
+        self.offsets.extend(base + x for x in other.offsets[1:])
+
+    def payload(self, row):
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
 
 
 class Journal:
-    def __init__(self, jfs):
-        self.fs = jfs
-        self.sb = JournalSuperBlock(jfs[:J_SB_LENGTH])
+    '''Journal stored in file (usually inode 8) of filesystem.
+    Journal blocks are translated through extent map of journal file.
+    Scanning works on memoryviews of image, so headers are decoded without
+    copying blocks; read_block returns copy of block as bytes.
+    :param image: mmap of filesystem image
+    :param extent_map: ext4.extents.ExtentMap of journal file
+    '''
+    def __init__(self, image, extent_map, block_size):
+        self.mmap = image
+        self.image = memoryview(image)
+        self.extent_map = extent_map
+        self.block_size = block_size
+        self.sb = JournalSuperBlock(self.read_block(0)[:J_SB_LENGTH])
         self.is64bit = self.sb.feature_incompat & JBD2_FEATURE_INCOMPAT_64BIT
+        self.blocks_count = min(self.sb.maxlen, self.__mapped_blocks())
+        self.__init_tag_layout()
+
+        self.has_csum = self.sb.feature_incompat & \
+            (JBD2_FEATURE_INCOMPAT_CSUM_V2 | JBD2_FEATURE_INCOMPAT_CSUM_V3)
+        if self.has_csum:
+            self.csum_seed = crc32c(self.sb.uuid)
 
-        if self.sb.feature_incompat & JBD2_FEATURE_INCOMPAT_CSUM_V3:
-            self.descriptor = JournalDescriptorV3
-            self.descriptor_size = J_DESC_V3_LENGTH
+    def __init_tag_layout(self):
+        '''Choose precompiled layout of descriptor tags and positions of
+        flags and high bits of block number in unpacked tag.'''
+        features = self.sb.feature_incompat
+        self.tail_size = 0
+        if features & (JBD2_FEATURE_INCOMPAT_CSUM_V2 |
+                       JBD2_FEATURE_INCOMPAT_CSUM_V3):
+            self.tail_size = J_TAIL_LENGTH
+        if features & JBD2_FEATURE_INCOMPAT_CSUM_V3:
+            self.tag, self.tag_flags, self.tag_high = J_TAG3, 1, 2
+            return
+        csum_v2 = features & JBD2_FEATURE_INCOMPAT_CSUM_V2
+        if self.is64bit:
+            self.tag = J_TAG_64_CSUM_V2 if csum_v2 else J_TAG_64
+            self.tag_flags, self.tag_high = 2, 3
         else:
-            self.descriptor = JournalDescriptorV2
-            self.descriptor_size = J_DESC_V2_LENGTH
+            self.tag = J_TAG_CSUM_V2 if csum_v2 else J_TAG
+            self.tag_flags, self.tag_high = 2, None
+
+    def __mapped_blocks(self):
+        if not len(self.extent_map):
+            return 0
+        return self.extent_map.logical[-1] + self.extent_map.length[-1]
+
+    def close(self):
+        '''Release view of image.'''
+        self.image.release()
 
     def get_blocks(self):
-        return chunk(self.fs, self.sb.blocksize)
+        return map(self.read_block, range(self.blocks_count))
 
     def read_block(self, index):
-        return self.fs[index*self.sb.blocksize:(index+1)*self.sb.blocksize]
+        '''Return bytes of journal block with specified index.'''
+        with self.__view_block(index) as block:
+            return bytes(block)
 
-    def create_journal_map(self):
-        '''Return dict where key is a block index and value is a list
-        of indexes of journal blocks which are the copies of this block.
-        List of copies is ordered by sequence.'''
+    def __view_block(self, index):
+        '''Return memoryview of journal block, it should be released
+        before journal is closed.'''
+        extents = self.extent_map
+        extent = extents.find(index)
+        if extent == -1:
+            raise ValueError('Journal block {} is not mapped.'.format(index))
+        physical = extents.physical[extent] + index - extents.logical[extent]
+        start = physical * self.block_size
+        return self.image[start:start+self.block_size]
 
-        journal_map = {}    # {sequence -> ([disc_indexes], [journal_indexes])}
-        current_sequence = 0
+    def next_block(self, index):
+        '''Index of journal block following index in circular log.'''
+        index += 1
+        return self.sb.first if index >= self.blocks_count else index
 
-        # need it to prevent bugs if journal was overwritten
-        previous_blocktype = None
+    def find_header_blocks(self, first=0, end=None):
+        '''Yields triples (journal block index, blocktype, sequence) of all
+        blocks in range [first, end) starting with JBD2 magic. Magic is
+        searched by mmap.find through contiguous runs of journal, so only
+        blocks which start with magic are decoded.'''
+        block_size = self.block_size
+        if end is None:
+            end = self.blocks_count
+        for logical, physical, length, _ in self.extent_map.runs():
+            skip = max(first - logical, 0)
+            length = min(logical + length, end) - logical - skip
+            if length <= 0:
+                continue
+            logical += skip
+            start = (physical + skip) * block_size
+            stop = start + length * block_size
+            position = start
+            while True:
+                position = self.mmap.find(JBD2_MAGIC_BYTES, position, stop)
+                if position == -1:
+                    break
+                misalign = (position - start) % block_size
+                if misalign:
+                    position += block_size - misalign
+                    continue
+                _, blocktype, sequence = J_HEADER.unpack_from(self.mmap,
+                                                              position)
+                yield logical + (position - start) // block_size, \
+                    blocktype, sequence
+                position += block_size
 
-        for index, block in enumerate(self.get_blocks()):
-            header = try_read_header(block)
+    def scan(self, first=0, end=None):
+        '''Decode all header blocks in range [first, end) of journal into
+        HeaderTable: tags of descriptors and records of revoke blocks.
+        Checksums of commit blocks are verified later, only for commits
+        reached by walk.'''
+        table = HeaderTable()
+        for index, blocktype, sequence in self.find_header_blocks(first, end):
+            if blocktype == BlockType.descriptor:
+                with self.__view_block(index) as block:
+                    table.append(index, blocktype, sequence,
+                                 values=self.read_tags(block))
+            elif blocktype == BlockType.revocation_record:
+                with self.__view_block(index) as block:
+                    table.append(index, blocktype, sequence,
+                                 values=self.read_revoked(block))
+            elif blocktype == BlockType.commit_record:
+                table.append(index, blocktype, sequence, COMMIT_UNCHECKED)
+            else:
+                table.append(index, blocktype, sequence)
+        return table
 
-            if header is None:
-                # print(index, 'block is a backup copy')
-                if previous_blocktype == BlockType.descriptor:
-                    journal_map[current_sequence][1].append(index)
-                # else:
-                    # print('I dont want to add it to map')
-                continue
+    def scan_parallel(self, jobs, image_path):
+        '''Same as scan, but journal is split into block ranges scanned by
+        jobs worker processes, which open image by image_path.'''
+        step = max(ceil(self.blocks_count / (jobs * RANGES_PER_JOB)), 1)
+        ranges = [(first, min(first + step, self.blocks_count))
+                  for first in range(0, self.blocks_count, step)]
+        table = HeaderTable()
+        with multiprocessing.Pool(jobs, init_scan_worker,
+                                  (image_path,)) as pool:
+            for part in pool.imap(scan_task, ranges):
+                table.extend(part)
+        return table
 
-            if header.blocktype == BlockType.commit_record:
-                # print(index, 'block is a commit record')
-                if previous_blocktype == BlockType.descriptor:
-                    assert current_sequence == header.sequence
-                    assert header.sequence in journal_map
+    def read_tags(self, block):
+        '''Return list of filesystem block numbers described by tags of
+        descriptor block. Tags of fixed size are unpacked by iter_unpack,
+        it is restarted only after tag followed by UUID (usually the
+        first one).'''
+        tag, flags_at, high_at = self.tag, self.tag_flags, self.tag_high
+        blocks = []
+        offset = J_HEADER_LENGTH
+        end = len(block) - self.tail_size
+        while offset + tag.size <= end:
+            count = (end - offset) // tag.size
+            tags = tag.iter_unpack(block[offset:offset + count * tag.size])
+            for values in tags:
+                offset += tag.size
+                blocknr = values[0]
+                if high_at is not None:
+                    blocknr |= values[high_at] << 32
+                blocks.append(blocknr)
+                flags = values[flags_at]
+                if flags & JournalDescFlags.last_tag:
+                    return blocks
+                if not flags & JournalDescFlags.uuid_omitted:
+                    offset += J_UUID_LENGTH
+                    break
+            else:
+                break
+        return blocks
 
-            if header.sequence not in journal_map:
-                journal_map[header.sequence] = [[], []]
+    def age(self, sequence):
+        '''Sequence relative to journal superblock sequence, so
+        transactions are ordered correctly across 32-bit wrap.'''
+        age = (sequence - self.sb.sequence) & SEQUENCE_MASK
+        return age - (1 << 32) if age & 0x80000000 else age
 
-            if header.blocktype == BlockType.descriptor:
-                # print(index, 'block is a descriptor block')
-                journal_map[header.sequence][0] += [x.blocknr for x in
-                                                    self.__enum_descs(block)]
-                current_sequence = header.sequence
+    def read_revoked(self, block):
+        '''Return list of filesystem block numbers revoked by revoke
+        block.'''
+        count = min(J_REVOKE_COUNT.unpack_from(block)[0],
+                    len(block) - self.tail_size)
+        record = J_REVOKE_64 if self.is64bit else J_REVOKE_32
+        end = count - (count - J_REVOKE_HEADER_LENGTH) % record.size
+        if end <= J_REVOKE_HEADER_LENGTH:
+            return []
+        records = block[J_REVOKE_HEADER_LENGTH:end]
+        return [blocknr for blocknr, in record.iter_unpack(records)]
 
-            previous_blocktype = header.blocktype
+    def commit_is_valid(self, block):
+        '''Check checksum of commit block of CSUM_V2/V3 journal.'''
+        if not self.has_csum:
+            return True
+        start, end = J_COMMIT_CHKSUM_OFFSET, J_COMMIT_CHKSUM_OFFSET + 4
+        checksum = int.from_bytes(block[start:end], 'big')
+        crc = crc32c(block[:start], self.csum_seed)
+        crc = crc32c(bytes(4), crc)
+        return crc32c(block[end:], crc) == checksum
 
-        return chain_journal_map(journal_map)
+    def read_transaction(self, table, rows, index, sequence):
+        '''Follow transaction with sequence starting at journal block index
+        through decoded header table, rows is {journal block -> row}.
+        Returns tuple (journal blocks of copies, filesystem blocks of
+        copies, revoked blocks, index of the block after commit) or None
+        if transaction is torn, overwritten or has invalid commit block.'''
+        jrn_blocks, disc_blocks, revoked = array('I'), array('Q'), []
+        for _ in range(self.blocks_count):
+            row = rows.get(index)
+            if row is None or table.sequence[row] != sequence:
+                return None
+            blocktype = table.blocktype[row]
+            if blocktype == BlockType.descriptor:
+                for blocknr in table.payload(row):
+                    index = self.next_block(index)
+                    jrn_blocks.append(index)
+                    disc_blocks.append(blocknr)
+            elif blocktype == BlockType.revocation_record:
+                revoked.extend(table.payload(row))
+            elif blocktype == BlockType.commit_record:
+                if table.valid[row] == COMMIT_UNCHECKED:
+                    with self.__view_block(index) as block:
+                        table.valid[row] = self.commit_is_valid(block)
+                if not table.valid[row]:
+                    return None
+                return jrn_blocks, disc_blocks, revoked, self.next_block(index)
+            else:
+                return None
+            index = self.next_block(index)
+        return None
 
-    def __enum_descs(self, block):
-        '''yields all descriptors from block'''
-        offset = 0
-        while True:
-            start = J_HEADER_LENGTH + offset
-            end = start + self.descriptor_size
-            desc = self.descriptor(block[start:end], self.is64bit)
-            yield desc
+    def find_transactions(self, table):
+        '''Return dict {sequence -> journal block} of the first blocks of
+        transactions found in header table.'''
+        starts = {}
+        sequences = table.sequence
+        for row in range(len(table)):
+            if table.blocktype[row] not in (BlockType.descriptor,
+                                            BlockType.revocation_record):
+                continue
+            # previous header in circular log belongs to other transaction
+            sequence = sequences[row]
+            if sequences[row - 1] != sequence or len(table) == 1:
+                starts.setdefault(sequence, table.index[row])
+        return starts
 
-            offset += desc.actual_size
-            if desc.flags & JournalDescFlags.last_tag:
-                break
+    def walk(self, table=None):
+        '''Yields tuples (sequence, journal blocks of copies, filesystem
+        blocks of copies, revoked blocks) of committed transactions from
+        the oldest one still found in log to the newest.
+        Walk follows sequence numbers from one transaction to the block
+        after its commit, across the end of circular log. If chain is
+        broken by torn or overwritten transaction, walk is resumed at the
+        next newer transaction found by magic sweep.
+        table -> HeaderTable of whole journal, scanned if not given.'''
+        if table is None:
+            table = self.scan()
+        rows = dict(zip(table.index, range(len(table))))
+        starts = self.find_transactions(table)
+        order = sorted(starts, key=self.age)
+        tried = set()
+        newest = None
+        for sequence in order:
+            if newest is not None and self.age(sequence) <= self.age(newest):
+                continue
+            index = starts[sequence]
+            while (index, sequence) not in tried:
+                tried.add((index, sequence))
+                transaction = self.read_transaction(table, rows, index,
+                                                    sequence)
+                if transaction is None:
+                    break
+                jrn_blocks, disc_blocks, revoked, index = transaction
+                yield sequence, jrn_blocks, disc_blocks, revoked
+                newest = sequence
+                sequence = (sequence + 1) & SEQUENCE_MASK
 
+    def create_journal_map(self, full_sweep=False, jobs=1, image_path=None):
+        '''Return ext4.jmap.JournalMap: mapping where key is a block index
+        and value is a list of indexes of journal blocks which are the
+        copies of this block. List of copies is ordered by sequence, most
+        recent copy first.
+        Only copies from committed transactions which are not revoked
+        later are included. If full_sweep is set, all descriptors found in
+        journal are used without validation, it helps with damaged logs.
+        If jobs > 1, journal is scanned by jobs processes, which open image
+        by image_path.'''
+        if jobs > 1:
+            table = self.scan_parallel(jobs, image_path)
+        else:
+            table = self.scan()
+        if full_sweep:
+            return self.__sweep_journal_map(table)
 
-def chain_journal_map(journal_map):
-    disc_blks = chain(*(x[0] for x in journal_map.values()))
-    jrn_blks = chain(*(x[1] for x in journal_map.values()))
+        ages, jrn_blocks, disc_blocks = array('q'), array('I'), array('Q')
+        revoked = {}    # filesystem block -> age of the newest revoke
+        for sequence, jrn, disc, transaction_revoked in self.walk(table):
+            age = self.age(sequence)
+            ages.extend([age] * len(jrn))
+            jrn_blocks.extend(jrn)
+            disc_blocks.extend(disc)
+            for disc_block in transaction_revoked:
+                revoked[disc_block] = max(age, revoked.get(disc_block, age))
 
-    sequence = dict((jrn_block, seq)
-                    for seq in journal_map
-                    for jrn_block in journal_map[seq][1])
+        if revoked:
+            # revoke record cancels copies in its and older transactions
+            keep = [revoked.get(disc, age - 1) < age
+                    for age, disc in zip(ages, disc_blocks)]
+            ages, jrn_blocks, disc_blocks = \
+                (array(x.typecode, (v for v, k in zip(x, keep) if k))
+                 for x in (ages, jrn_blocks, disc_blocks))
+        return build_journal_map(ages, jrn_blocks, disc_blocks)
 
-    sort_func = lambda x: x[0]
-    block_pairs = sorted(zip(disc_blks, jrn_blks), key=sort_func)
-    return dict((disc_blk, sorted([jrn_blk for _, jrn_blk in jrn_blks],
-                           key=lambda blk: sequence[blk], reverse=True))
-                for disc_blk, jrn_blks in groupby(block_pairs, sort_func))
+    def __sweep_journal_map(self, table):
+        ages, jrn_blocks, disc_blocks = array('q'), array('I'), array('Q')
+        for row in range(len(table)):
+            if table.blocktype[row] != BlockType.descriptor:
+                continue
+            data_block = table.index[row]
+            tags = table.payload(row)
+            ages.extend([self.age(table.sequence[row])] * len(tags))
+            disc_blocks.extend(tags)
+            for _ in tags:
+                data_block = self.next_block(data_block)
+                jrn_blocks.append(data_block)
+        return build_journal_map(ages, jrn_blocks, disc_blocks)
 
 
-def try_read_header(journal_block):
-    '''return None if cannot create correct header'''
-    try:
-        return JournalBlockHeader(journal_block[:J_HEADER_LENGTH])
-    except AssertionError:
-        return None
+# State of journal scan worker process, see init_scan_worker
+_worker = {}
+
+
+def init_scan_worker(image_path):
+    from ext4.filesystem import FileSystem
+    _worker['fs'] = FileSystem(open(image_path, 'rb'))
+
+
+def scan_task(journal_range):
+    return _worker['fs'].journal.scan(*journal_range)
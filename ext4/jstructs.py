@@ -2,8 +2,7 @@ from enum import IntEnum
 import struct
 
 from ext4.structs import ExtStruct
-from cmapping.typedef import *
-from cmapping.endianness import big_endian
+from ext4.typedef import *
 from ext4.utils import convert_ints_to_long
 
 
@@ -14,10 +13,35 @@ J_HEADER_LENGTH = 12
 J_SB_LENGTH = 1024
 J_DESC_V2_LENGTH = 28
 J_DESC_V3_LENGTH = 32
-J_COMMIT_LENGTH = 32
+J_COMMIT_LENGTH = 60
+J_REVOKE_HEADER_LENGTH = 16
+J_COMMIT_CHKSUM_OFFSET = 16
 
 
+J_UUID_LENGTH = 16
+J_TAIL_LENGTH = 4
+
+JBD2_MAGIC_BYTES = struct.pack('>I', JBD2_MAGIC)
+
+# magic, blocktype, sequence
+J_HEADER = struct.Struct('>III')
+# bytes used by revoke block, including header
+J_REVOKE_COUNT = struct.Struct('>12xI')
+J_REVOKE_32 = struct.Struct('>I')
+J_REVOKE_64 = struct.Struct('>Q')
+# tag of CSUM_V3 journal: blocknr, flags, blocknr_high, checksum
+J_TAG3 = struct.Struct('>IIII')
+# tags of other journals: blocknr, checksum, flags, [blocknr_high]
+J_TAG = struct.Struct('>IHH')
+J_TAG_64 = struct.Struct('>IHHI')
+# CSUM_V2 journals reserve two more bytes for every tag
+J_TAG_CSUM_V2 = struct.Struct('>IHH2x')
+J_TAG_64_CSUM_V2 = struct.Struct('>IHHI2x')
+
+
+JBD2_FEATURE_INCOMPAT_REVOKE = 0x1
 JBD2_FEATURE_INCOMPAT_64BIT = 0x2
+JBD2_FEATURE_INCOMPAT_ASYNC_COMMIT = 0x4
 JBD2_FEATURE_INCOMPAT_CSUM_V2 = 0x8
 JBD2_FEATURE_INCOMPAT_CSUM_V3 = 0x10
 
@@ -120,9 +144,9 @@ class JournalCommitBlock(JournalStruct):
     chksum_type = UnsignedChar()
     chksum_size = UnsignedChar()
     padding = Padding(2)
-    chksum = CString(28)
-    commit_sec = Long()
-    commit_nsec = Integer()
+    chksum = UnsignedInteger(8)
+    commit_sec = LongLong()
+    commit_nsec = UnsignedInteger()
 
     def __init__(self, data):
         super().__init__(data, J_COMMIT_LENGTH)
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 
 import sys
-from os import path
+import csv
+import struct
+import hashlib
+import multiprocessing
+from os import path, remove
 from math import ceil
+from array import array
+from bisect import bisect_left, bisect_right
 from itertools import chain, groupby
 from datetime import datetime
 
 from ext4 import FileSystem
-from ext4.utils import del_trailing_zeros
 from ext4.structs import Inode, INODE_SIZE
+from ext4.scan import scan_deleted_inodes, iter_inode_ranges, find_live
 from logger import Logger, LogType
 
 
@@ -25,9 +31,22 @@ block: {inode.block}
 
 DEFAULT_RESTORED_DIR = 'RESTORED'
 
+# Block groups are given to restore workers by chunks of this size
+GROUPS_PER_TASK = 16
 
-# Map: {block_index -> [journal_block_indexes]}, where
-# [jornal_block_indexes] is a list if indexes of block_index
+# Candidates with smaller estimated fraction of not overwritten blocks
+# are skipped. Fully overwritten candidates are skipped always.
+DEFAULT_MIN_RECOVERABLE = 0.0
+
+# Restored files and skipped duplicates are listed in this file
+# of restore dir
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_FIELDS = ('file', 'inode_addr', 'dtime', 'size', 'sha256',
+                   'duplicate_of')
+
+
+# Map: {block_index -> [journal_block_indexes]} (ext4.jmap.JournalMap),
+# where [jornal_block_indexes] is a list if indexes of block_index
 # copies stored in journal.
 # List is guaranteed to be sorted by actuality.
 # (index of most recent copy goes first)
@@ -47,25 +66,35 @@ def inodes_are_relatives(ino1, ino2):
             ino1.mode == ino2.mode
 
 
-def find_predecessors(journal, inode_block, inode_offset):
-    '''Find in journal all saved non-zero copies of inode that
-    was written to inode_block by inode_offset'''
-    if inode_block not in journal_map:
-        return
+def find_predecessors(fs, deleted):
+    '''Find in journal all saved non-zero copies of deleted inodes.
+    deleted -> list of pairs (inode number, Inode)
+    Returns dict {inode number -> [Inode]}, most recent copy first.
+    Inodes are joined by inode table block: each journal copy of the block
+    is read once and all its slots are checked at once.'''
+    wanted = {}     # inode table block -> {slot -> inode number}
+    inode_size = fs.sb.inode_size
+    for index, _ in deleted:
+        _, ino_block, ino_offset = get_inode_params(fs, index)
+        wanted.setdefault(ino_block, {})[ino_offset // inode_size] = index
 
-    for jrn_block in map(journal.read_block, journal_map[inode_block]):
-        cmp_inode = Inode(jrn_block[inode_offset:inode_offset+INODE_SIZE])
-        if cmp_inode.dtime == 0 and cmp_inode.ctime > 0:
-            yield cmp_inode
+    predecessors = {}
+    for ino_block, slots in wanted.items():
+        if ino_block not in journal_map:
+            continue
+        for jrn_block in map(fs.journal.read_block, journal_map[ino_block]):
+            for slot in find_live(jrn_block, inode_size):
+                if slot in slots:
+                    start = slot * inode_size
+                    inode = Inode(jrn_block[start:start+INODE_SIZE])
+                    predecessors.setdefault(slots[slot], []).append(inode)
+    return predecessors
 
 
-def get_deleted_inodes(fs):
-    '''Iterate over all inodes in fs and yield all deleted inodes'''
-    for inode_index in range(fs.sb.inodes_count):
-        inode = fs.open_inode(inode_index)
-        if (inode.dtime != 0 or inode.links_count == 0) \
-                and inode.block != b'\x00' * len(inode.block):
-            yield inode_index, inode
+def get_deleted_inodes(fs, groups=None):
+    '''Iterate over all inodes in fs (or in specified block groups)
+    and yield all deleted inodes'''
+    return scan_deleted_inodes(fs, groups)
 
 
 def get_inode_params(fs, index):
@@ -76,39 +105,297 @@ def get_inode_params(fs, index):
     return inode_address, inode_block, inode_offset
 
 
-def try_restore_data(fs, inode, filename):
+class LiveBlocks:
+    '''Disk blocks referenced by extent maps of live (allocated) inodes.
+    Blocks are kept as sorted merged ranges with prefix sums of lengths,
+    so count of live blocks in any range is found by binary search.
+    '''
+    def __init__(self, fs):
+        ranges = []
+        per_group = fs.sb.inodes_per_group
+        for group, first, end in iter_inode_ranges(fs, allocated_only=True):
+            for row in range(first, end):
+                inode = fs.read_inode(group * per_group + row + 1)
+                runs = read_runs_safe(fs, inode) or ()
+                ranges.extend((start, start + length)
+                              for start, length in runs)
+        ranges.sort()
+
+        self.starts, self.ends = array('Q'), array('Q')
+        self.prefix = array('Q', [0])
+        for start, end in ranges:
+            if self.ends and start <= self.ends[-1]:
+                if end > self.ends[-1]:
+                    self.prefix[-1] += end - self.ends[-1]
+                    self.ends[-1] = end
+                continue
+            self.starts.append(start)
+            self.ends.append(end)
+            self.prefix.append(self.prefix[-1] + end - start)
+
+    def count(self, start, length):
+        '''Count live blocks in range [start, start + length).'''
+        end = start + length
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        if first >= last:
+            return 0
+        count = self.prefix[last] - self.prefix[first]
+        count -= max(0, start - self.starts[first])
+        count -= max(0, self.ends[last - 1] - end)
+        return count
+
+
+def read_runs_safe(fs, inode):
+    '''Return physical runs of inode or None if its extent tree cannot be
+    read (it is not extent mapped or tree blocks were overwritten).'''
+    try:
+        return fs.physical_runs(inode)
+    except (AssertionError, ValueError, OverflowError, struct.error):
+        return None
+
+
+def assess_inode(fs, inode, live_blocks=None):
+    '''Estimate how much of inode data is not overwritten yet, without
+    reading the data. Block is considered overwritten if it is allocated
+    in block bitmap or (if live_blocks is given) referenced by live inode.
+    Returns pair (blocks count, not overwritten blocks count), or None if
+    inode data cannot be located.'''
+    runs = read_runs_safe(fs, inode)
+    if runs is None:
+        return None
+    total = free = 0
+    for start, length in runs:
+        total += length
+        # blocks beyond the end of filesystem are garbage
+        length = max(0, min(length, fs.sb.blocks_count - start))
+        if length == 0:
+            continue
+        used = fs.bitmaps.count_allocated_blocks(start, length)
+        if live_blocks is not None:
+            used = max(used, live_blocks.count(start, length))
+        free += length - used
+    return total, free
+
+
+def recoverable_fraction(total, free):
+    return free / total if total else 0.0
+
+
+def fingerprint_safe(fs, inode):
+    '''Return fs.data_fingerprint of inode or None if its extent tree
+    cannot be read.'''
+    try:
+        return fs.data_fingerprint(inode)
+    except (AssertionError, ValueError, OverflowError, struct.error):
+        return None
+
+
+def try_restore_data(fs, inode, filename, digest=None):
     '''Try extract data from <inode> and if data is not empty
-    save it to <filename>'''
-    data = b''.join(fs.extract_file_bytes(inode))
-    if data:
+    save it to <filename>. Data is streamed from image to file.
+    digest -> hashlib object updated with written data.'''
+    if inode.size > 0:
         Logger.log('Restoring data...', LogType.info)
         with open(filename, 'wb') as f:
-            f.write(del_trailing_zeros(data))
+            fs.copy_file(inode, f.fileno(), digest)
         Logger.log('Part of data restored to ' + filename, LogType.always)
     else:
         Logger.log('cannot restore data: inode is empty.', LogType.warning)
 
 
-def restore_deleted_files(filesystem, restored_dir=DEFAULT_RESTORED_DIR):
+def find_candidates(fs, groups=None, live_blocks=None, restore_filter=None):
+    '''Yields descriptors of deleted inodes found in fs (or in specified
+    block groups): triples (inode address, dtime, predecessors), where
+    predecessors is a list of triples (Inode found in journal, assessment,
+    see assess_inode, and data fingerprint, see fingerprint_safe).
+    Nothing is written, so descriptors can be built by workers and
+    restored in order by one process.
+    Deleted inodes are joined with journal group by group.
+    restore_filter -> ext4.filters.RestoreFilter, rejected inodes and
+    predecessors are dropped before their data is located.'''
+    per_group = fs.sb.inodes_per_group
+    deleted = get_deleted_inodes(fs, groups)
+    if restore_filter is not None:
+        deleted = (x for x in deleted
+                   if restore_filter.match_deleted(x[1].dtime))
+    for _, group in groupby(deleted, lambda x: (x[0] - 1) // per_group):
+        group = list(group)
+        predecessors = find_predecessors(fs, group)
+        for index, inode in group:
+            yield fs.find_inode_addr(index), inode.dtime, \
+                list(describe_predecessors(fs, predecessors.get(index, ()),
+                                           live_blocks, restore_filter))
+
+
+def describe_predecessors(fs, inodes, live_blocks=None, restore_filter=None):
+    '''Yields triples (Inode, assessment, fingerprint) for inodes accepted
+    by restore_filter.'''
+    for inode in inodes:
+        if restore_filter is not None and \
+                not restore_filter.match_inode(inode):
+            continue
+        assessment = assess_inode(fs, inode, live_blocks)
+        if restore_filter is not None and restore_filter.magic and (
+                assessment is None or
+                not restore_filter.match_data(fs, inode)):
+            continue
+        yield inode, assessment, fingerprint_safe(fs, inode)
+
+
+# State of restore worker process, see init_worker
+_worker = {}
+
+
+def init_worker(image_path, jrn_map, live_blocks, restore_filter):
+    '''Open image in worker process. Image is mapped again, so pages
+    are shared with other processes through OS page cache.'''
+    global journal_map
+    journal_map = jrn_map
+    _worker['fs'] = FileSystem(open(image_path, 'rb'))
+    _worker['live_blocks'] = live_blocks
+    _worker['restore_filter'] = restore_filter
+
+
+def find_candidates_task(groups):
+    return list(find_candidates(_worker['fs'], groups,
+                                _worker['live_blocks'],
+                                _worker['restore_filter']))
+
+
+def find_candidates_parallel(fs, jobs, image_path, live_blocks=None,
+                             restore_filter=None):
+    '''Same as find_candidates, but block groups are partitioned between
+    jobs worker processes. Descriptors are yielded in the same order.'''
+    tasks = [range(start, min(start + GROUPS_PER_TASK, fs.groups_count))
+             for start in range(0, fs.groups_count, GROUPS_PER_TASK)]
+    initargs = (image_path, journal_map, live_blocks, restore_filter)
+    with multiprocessing.Pool(jobs, init_worker, initargs) as pool:
+        for candidates in pool.imap(find_candidates_task, tasks):
+            yield from candidates
+
+
+def restore_deleted_files(filesystem, restored_dir=DEFAULT_RESTORED_DIR,
+                          min_recoverable=DEFAULT_MIN_RECOVERABLE,
+                          check_live=False, jobs=1, image_path=None,
+                          full_sweep=False, index_path=None,
+                          restore_filter=None):
     '''Restore recently deleted files from filesystem and push them
-    to restore dir.'''
+    to restore dir. Candidates are checked against block bitmap (and
+    extent maps of live inodes, if check_live is set) before reading
+    data, mostly overwritten ones are skipped.
+    If jobs > 1, journal is scanned and candidates are searched by jobs
+    processes, which open image by image_path (name of filesystem image
+    file by default).
+    Files are written by this process in the same order in any case.
+    Copies of inode with the same data are restored once, duplicates are
+    only listed in manifest file of restore dir (see MANIFEST_FIELDS).
+    full_sweep -> use all block copies found in journal instead of copies
+    from committed and not revoked transactions (for damaged journals).
+    index_path -> path of journal map index, it is reused by next runs
+    while image is not changed. None disables index.
+    restore_filter -> ext4.filters.RestoreFilter, only files accepted by it
+    are restored. It is checked on inode metadata and on the first data
+    block, so rejected files cost no data reads.
+    Returns triple (count of written files, count of skipped unrecoverable
+    copies, estimated recoverable fraction of restored data). Empty copies
+    and duplicates are not counted in either.'''
     global journal_map
 
     fs = filesystem
+    if image_path is None:
+        image_path = fs.image_file.name
     Logger.log('Map filesystem to journal..', LogType.always)
-    journal_map = fs.journal.create_journal_map()
-
-    fileindex = 0
-    for index, inode in get_deleted_inodes(fs):
-
-        ino_addr, ino_block, ino_offset = get_inode_params(fs, index)
-        Logger.log('Found deleted inode at ' + hex(ino_addr), LogType.always)
-        predecessors = find_predecessors(fs.journal, ino_block, ino_offset)
-
-        for restored_inode in predecessors:
-            Logger.log('Found predecessor in journal!', LogType.info)
-            filename = '{} - {}'.format(datetime.fromtimestamp(inode.dtime),
-                                        str(fileindex))
-            try_restore_data(fs, restored_inode,
-                             path.join(restored_dir, filename))
-            fileindex += 1
+    journal_map = fs.journal_map(full_sweep, jobs, index_path,
+                                 image_path)
+
+    live_blocks = None
+    if check_live:
+        Logger.log('Map live inodes to blocks..', LogType.always)
+        live_blocks = LiveBlocks(fs)
+
+    if jobs > 1:
+        candidates = find_candidates_parallel(fs, jobs, image_path,
+                                              live_blocks, restore_filter)
+    else:
+        candidates = find_candidates(fs, live_blocks=live_blocks,
+                                     restore_filter=restore_filter)
+
+    fileindex = skipped = empty = duplicates = 0
+    total_blocks = free_blocks = 0
+    by_fingerprint = {}     # data fingerprint -> name of restored file
+    by_digest = {}          # content digest -> name of restored file
+    manifest_file = open(path.join(restored_dir, MANIFEST_NAME), 'w',
+                         newline='')
+    with manifest_file:
+        manifest = csv.writer(manifest_file)
+        manifest.writerow(MANIFEST_FIELDS)
+        for ino_addr, dtime, predecessors in candidates:
+            Logger.log('Found deleted inode at ' + hex(ino_addr),
+                       LogType.always)
+
+            for restored_inode, assessment, fingerprint in predecessors:
+                Logger.log('Found predecessor in journal!', LogType.info)
+                if assessment is None:
+                    Logger.log('cannot locate data of predecessor, skipped.',
+                               LogType.warning)
+                    skipped += 1
+                    continue
+                total, free = assessment
+                fraction = recoverable_fraction(total, free)
+                if total and (free == 0 or fraction < min_recoverable):
+                    Logger.log('data is overwritten ({:.0%} left), skipped.'
+                               .format(fraction), LogType.warning)
+                    skipped += 1
+                    continue
+                if restored_inode.size == 0:
+                    Logger.log('predecessor is empty, skipped.',
+                               LogType.warning)
+                    empty += 1
+                    continue
+
+                # the same data may be referenced by many copies of inode:
+                # it is recognized by location before reading data and by
+                # content hashed while file is written
+                size = restored_inode.size
+                original = by_fingerprint.get(fingerprint)
+                if original is not None:
+                    Logger.log('duplicate of ' + original + ', skipped.',
+                               LogType.info)
+                    manifest.writerow(('', hex(ino_addr), dtime, size,
+                                       '', original))
+                    duplicates += 1
+                    continue
+
+                filename = '{} - {}'.format(datetime.fromtimestamp(dtime),
+                                            str(fileindex))
+                filepath = path.join(restored_dir, filename)
+                digest = hashlib.sha256()
+                try_restore_data(fs, restored_inode, filepath, digest)
+                digest = digest.hexdigest()
+                original = by_digest.get(digest)
+                if original is not None:
+                    remove(filepath)
+                    Logger.log('duplicate of ' + original + ', removed.',
+                               LogType.info)
+                    by_fingerprint[fingerprint] = original
+                    manifest.writerow(('', hex(ino_addr), dtime, size,
+                                       digest, original))
+                    duplicates += 1
+                    continue
+
+                Logger.log('Estimated recoverable: {:.0%} of {} blocks'
+                           .format(fraction, total), LogType.info)
+                total_blocks += total
+                free_blocks += free
+                fileindex += 1
+                by_fingerprint[fingerprint] = by_digest[digest] = filename
+                manifest.writerow((filename, hex(ino_addr), dtime, size,
+                                   digest, ''))
+
+    fraction = recoverable_fraction(total_blocks, free_blocks)
+    Logger.log('Restored {} files, skipped {}, empty {}, duplicates {}, '
+               'estimated recoverable: {:.0%}'
+               .format(fileindex, skipped, empty, duplicates, fraction),
+               LogType.always)
+    return fileindex, skipped, fraction
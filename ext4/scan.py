@@ -0,0 +1,135 @@
+'''Bulk scanning of inode tables.
+Whole inode table of block group is inspected at once and Inode objects
+are built only for matching rows. If NumPy is installed, table is viewed
+as structured array right over the image mmap without copying and
+predicates are vectorized; otherwise struct.iter_unpack is used.
+'''
+
+import struct
+
+from ext4.consts import EXT4_BG_INODE_UNINIT, RO_COMPAT_GDT_CSUM, \
+                        RO_COMPAT_METADATA_CSUM
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Offsets of inode fields used by predicates, see ext4.structs.Inode.
+INODE_FIELDS = (
+    ('mode', '<u2', 0),
+    ('size_lo', '<u4', 4),
+    ('ctime', '<i4', 12),
+    ('dtime', '<u4', 20),
+    ('links_count', '<u2', 26),
+    ('flags', '<u4', 32),
+    ('block', '<u4', 40, 15),
+)
+# dtime, links_count, block
+INODE_PREDICATE_FORMAT = '<20xI2xH12x60s'
+# ctime, dtime
+INODE_TIMES_FORMAT = '<12xi4xI76x'
+
+
+def inode_dtype(inode_size):
+    '''NumPy structured dtype of on-disk inode with inode_size bytes.'''
+    names, formats, offsets = [], [], []
+    for field in INODE_FIELDS:
+        names.append(field[0])
+        formats.append(field[1] if len(field) == 3 else (field[1], field[3]))
+        offsets.append(field[2])
+    return numpy.dtype({'names': names, 'formats': formats,
+                        'offsets': offsets, 'itemsize': inode_size})
+
+
+def find_deleted(table, inode_size):
+    '''Return indexes of rows of inode table (buffer) which are deleted
+    and still have non-empty i_block.'''
+    if numpy is not None:
+        return _find_deleted_numpy(table, inode_size)
+    return _find_deleted_python(table, inode_size)
+
+
+def _find_deleted_numpy(table, inode_size):
+    count = len(table) // inode_size
+    inodes = numpy.frombuffer(table, inode_dtype(inode_size), count)
+    deleted = (inodes['dtime'] != 0) | (inodes['links_count'] == 0)
+    deleted &= inodes['block'].any(axis=1)
+    return numpy.flatnonzero(deleted).tolist()
+
+
+def _find_deleted_python(table, inode_size):
+    layout = INODE_PREDICATE_FORMAT + 'x' * (inode_size - 100)
+    empty = bytes(60)
+    count = len(table) // inode_size
+    rows = struct.iter_unpack(layout, memoryview(table)[:count * inode_size])
+    return [index for index, (dtime, links_count, block) in enumerate(rows)
+            if (dtime != 0 or links_count == 0) and block != empty]
+
+
+def find_live(table, inode_size):
+    '''Return indexes of rows of inode table (buffer) which hold live
+    inodes: not deleted (dtime is zero) and ever changed (ctime is set).'''
+    count = len(table) // inode_size
+    if numpy is not None:
+        inodes = numpy.frombuffer(table, inode_dtype(inode_size), count)
+        live = (inodes['dtime'] == 0) & (inodes['ctime'] > 0)
+        return numpy.flatnonzero(live).tolist()
+    layout = INODE_TIMES_FORMAT + 'x' * (inode_size - 100)
+    rows = struct.iter_unpack(layout, memoryview(table)[:count * inode_size])
+    return [index for index, (ctime, dtime) in enumerate(rows)
+            if dtime == 0 and ctime > 0]
+
+
+def iter_inode_ranges(fs, allocated_only=False, groups=None):
+    '''Yields triples (group, first row, end row) of inode table regions
+    which can contain real inode data. Groups with uninitialized inode
+    table and unused tail of each table (itable_unused, valid only when
+    group descriptors have checksums) are skipped. If allocated_only is
+    set, inode bitmap is consulted and only allocated inodes are yielded.
+    groups -> iterable of group numbers to scan, all groups by default.
+    '''
+    per_group = fs.sb.inodes_per_group
+    inode_size = fs.sb.inode_size
+    has_csum = fs.sb.feature_ro_compat & \
+        (RO_COMPAT_GDT_CSUM | RO_COMPAT_METADATA_CSUM)
+
+    if groups is None:
+        groups = range(fs.groups_count)
+    for group in groups:
+        if has_csum and fs.gdt.flags[group] & EXT4_BG_INODE_UNINIT:
+            continue
+        end = per_group
+        if has_csum:
+            end -= min(fs.gdt.itable_unused[group], per_group)
+
+        # image may be truncated
+        table = fs.gdt.inode_table[group] * fs.sb.block_size
+        end = min(end, (len(fs.image) - table) // inode_size)
+        if end <= 0:
+            continue
+
+        if not allocated_only:
+            yield group, 0, end
+            continue
+        for first, last in fs.bitmaps.allocated_inode_runs(group, end):
+            yield group, first, last
+
+
+def scan_deleted_inodes(fs, groups=None):
+    '''Yields pairs (inode number, Inode) of all deleted inodes with
+    non-empty i_block, group by group. Only regions of inode tables which
+    can contain inodes are read.
+    groups -> iterable of group numbers to scan, all groups by default.'''
+    inode_size = fs.sb.inode_size
+    per_group = fs.sb.inodes_per_group
+    for group, first, end in iter_inode_ranges(fs, groups=groups):
+        start = fs.gdt.inode_table[group] * fs.sb.block_size
+        with memoryview(fs.image) as image:
+            table = image[start + first * inode_size:start + end * inode_size]
+            rows = find_deleted(table, inode_size)
+            del table
+        for row in rows:
+            index = group * per_group + first + row + 1
+            yield index, fs.read_inode(index)
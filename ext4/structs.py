@@ -1,43 +1,117 @@
 #!/usr/bin/env python3
 
 import struct
+from collections import OrderedDict
 
 from ext4.consts import *
 from ext4.utils import convert_ints_to_long
+from ext4.typedef import *
 
-from cmapping import CStruct
-from cmapping.endianness import little_endian
-from cmapping.typedef import *
 
-
-class ExtStruct(CStruct):
+class ExtStructMeta(type):
+    '''Compiles declared fields of ext4 structure into one struct.Struct
+    layout and precomputes plan of merging '_lo' and '_hi' fields, so
+    decoding of structure is one unpack_from call plus fixed assignments.
+    Fields are stored in __slots__, so instances have no __dict__.
+    '''
+    @classmethod
+    def __prepare__(mcs, name, bases):
+        return OrderedDict()
+
+    def __new__(mcs, name, bases, namespace):
+        fields = [(k, v) for k, v in namespace.items() if isinstance(v, CType)]
+        for field, _ in fields:
+            del namespace[field]
+
+        parent_fields = []
+        for base in bases:
+            parent_fields = getattr(base, '_fields', parent_fields)
+        all_fields = list(parent_fields) + fields
+
+        endianness = namespace.get('endianness')
+        if endianness is None:
+            endianness = next((b.endianness for b in bases
+                               if hasattr(b, 'endianness')), little_endian)
+
+        names = [f for f, t in fields if not isinstance(t, Padding)]
+        merged = [f[:-3] for f in names if f.endswith('_lo')]
+        extra = namespace.get('__slots__', ())
+        namespace['__slots__'] = tuple(names + merged) + tuple(extra)
+
+        cls = super().__new__(mcs, name, bases, dict(namespace))
+        cls._fields = tuple(all_fields)
+        cls.endianness = endianness
+        mcs.compile(cls)
+        return cls
+
+    @staticmethod
+    def compile(cls):
+        '''Build layout, assignment plan and merge plan for cls.'''
+        layout = cls.endianness + ''.join(t.format for _, t in cls._fields)
+        cls._layout = struct.Struct(layout)
+        cls._size = cls._layout.size
+
+        plan = []
+        index = 0
+        for field, ctype in cls._fields:
+            if isinstance(ctype, Padding):
+                continue
+            if ctype.is_array:
+                plan.append((field, index, index + ctype.count))
+                index += ctype.count
+            else:
+                plan.append((field, index, None))
+                index += 1
+        cls._plan = tuple(plan)
+        cls._plain_fields = tuple(f for f, _, end in plan if end is None)
+        cls._is_plain = len(cls._plain_fields) == len(plan)
+
+        names = [f for f, _, _ in plan]
+        types = dict(cls._fields)
+        cls._merge_plan = tuple(
+            (f[:-3], f, f[:-3] + '_hi' if f[:-3] + '_hi' in names else None,
+             types[f].bits)
+            for f in names if f.endswith('_lo'))
+
+
+class ExtStruct(metaclass=ExtStructMeta):
     '''Base for ext4 structures. It can resolve two fields with same name
-    that end with '_ho' and '_lo' and create one without suffix filled
+    that end with '_hi' and '_lo' and create one without suffix filled
     with correct value.
     '''
+    __slots__ = ()
+
     def __init__(self, data, length=None):
         if length is not None and len(data) != length:
             raise ValueError('Expected {} bytes.'.format(length))
 
-        super().__init__(data)
+        self.decode(data)
         self.resolve_long_data()
 
+    def decode(self, data, offset=0):
+        '''Unpack all fields from data starting at offset.'''
+        values = self._layout.unpack_from(data, offset)
+        if self._is_plain:
+            for field, value in zip(self._plain_fields, values):
+                setattr(self, field, value)
+            return
+        for field, start, end in self._plan:
+            if end is None:
+                setattr(self, field, values[start])
+            else:
+                setattr(self, field, values[start:end])
+
     def resolve_long_data(self):
-        '''Finds attrs with same name that end with '_ho' and '_lo' and
-        create one without suffix filled with correct value.
+        '''Merge each pair of attrs ended with '_lo' and '_hi' into one
+        attr without suffix according to precomputed merge plan.
         '''
-        lo_attrs = (x for x in dir(self) if x.endswith('lo'))
-        for lo_attr in lo_attrs:
-            self.join_attrs(lo_attr, lo_attr[:-2] + 'hi')
-
-    def join_attrs(self, lo_attr, hi_attr):
-        ''' Merge attrs ended with '_ho' and '_lo' into one '''
-        low = getattr(self, lo_attr)
-        if hasattr(self, hi_attr):
-            high = getattr(self, hi_attr)
-            setattr(self, lo_attr[:-3], convert_ints_to_long(low, high))
-        else:
-            setattr(self, lo_attr[:-3], low)
+        for attr, lo_attr, hi_attr, bits in self._merge_plan:
+            low = getattr(self, lo_attr)
+            if hi_attr is None:
+                setattr(self, attr, low)
+            else:
+                setattr(self, attr, convert_ints_to_long(
+                    low, getattr(self, hi_attr), bits))
 
 
 class SuperBlock(ExtStruct):
@@ -46,6 +120,7 @@ class SuperBlock(ExtStruct):
     maintenance information, and more.
     :param data: 1024 bytes long
     '''
+    __slots__ = ('block_size', 'cluster_size')
     endianness = little_endian
 
     inodes_count = Integer()
@@ -148,6 +223,7 @@ class GroupDescriptor(ExtStruct):
     descriptors associated with it.
     :param data: 32 or 64 bytes long
     '''
+    __slots__ = ('is64',)
     endianness = little_endian
 
     # 32x-descriptor
@@ -253,18 +329,21 @@ class ExtentLeaf(ExtStruct):
     ''' Leaf nodes of the extent tree.
     :param data: 12 bytes long
     '''
+    __slots__ = ('uninit',)
     endianness = little_endian
 
-    block = Integer()
+    block = UnsignedInteger()
     length = Short()
     start_hi = Short()
     start_lo = Integer()
 
     def __init__(self, data):
         super().__init__(data, EXTENT_SIZE)
-        if self.length > 32768:
+        self.length &= 0xFFFF
+        self.uninit = self.length > EXTENT_INIT_MAX_LEN
+        if self.uninit:
             # then extent is uninitialized and the actual length is:
-            self.length = self.length - 32768
+            self.length = self.length - EXTENT_INIT_MAX_LEN
 
     def __str__(self):
         return '<ExtentLeaf: at {s.start} - {s.length} blocks>'.format(s=self)
@@ -276,7 +355,7 @@ class ExtentBranch(ExtStruct):
     '''
     endianness = little_endian
 
-    block = Integer()
+    block = UnsignedInteger()
     leaf_lo = Integer()
     leaf_hi = Short()
     unused = Padding(2)
@@ -349,6 +428,8 @@ class DirectoryEntry(ExtStruct):
     This structure does not contain name, though you'll need to parse it
     by you own hands for sure.
     '''
+    __slots__ = ('name',)
+
     inode = Integer()
     rec_len = Short()
     name_len = UnsignedChar()
@@ -0,0 +1,6 @@
+class Leaf:
+    '''Stand-in for extent tree leaf: block is logical block of extent,
+    start is its first physical block.'''
+    def __init__(self, block, start, length, uninit=False):
+        self.block, self.start, self.length = block, start, length
+        self.uninit = uninit
@@ -0,0 +1,115 @@
+import unittest
+
+from ext4 import FileSystem
+from ext4 import bitmap
+from ext4.consts import EXT4_BG_BLOCK_UNINIT
+from ext4.tests.config import PATH_TO_IMAGE
+
+
+def naive_bit_runs(data, count, value):
+    first = None
+    for index in range(count):
+        matches = (data[index >> 3] >> (index & 7) & 1) == value
+        if matches and first is None:
+            first = index
+        elif not matches and first is not None:
+            yield first, index
+            first = None
+    if first is not None:
+        yield first, count
+
+
+class TestBitOperations(unittest.TestCase):
+    def test_bit_runs(self):
+        data = bytes([0b11100110, 0b1])
+        self.assertEqual(list(bitmap.bit_runs(data, 10)), [(1, 3), (5, 9)])
+        self.assertEqual(list(bitmap.bit_runs(data, 10, 0)),
+                         [(0, 1), (3, 5), (9, 10)])
+
+    def test_bit_runs_long(self):
+        data = bytes([0xFF, 0xFF, 0x0F, 0, 0, 0xF0, 0xFF, 0x01, 0])
+        for count in (0, 7, 16, 20, 40, 57, 72):
+            for value in (0, 1):
+                self.assertEqual(list(bitmap.bit_runs(data, count, value)),
+                                 list(naive_bit_runs(data, count, value)))
+
+    def test_bit_runs_clipped_to_count(self):
+        self.assertEqual(list(bitmap.bit_runs(bytes([0xFF, 0b110000]), 10)),
+                         [(0, 8)])
+        self.assertEqual(list(bitmap.bit_runs(bytes([0xFF, 0x0F]), 10)),
+                         [(0, 10)])
+        self.assertEqual(list(bitmap.bit_runs(bytes([0x0F, 0xFF]), 6, 0)),
+                         [(4, 6)])
+
+    def test_count_bits(self):
+        data = bytes([0b11100110, 0xFF, 0b1])
+        self.assertEqual(bitmap.count_bits(data, 0, 24), 14)
+        self.assertEqual(bitmap.count_bits(data, 2, 6), 2)
+        self.assertEqual(bitmap.count_bits(data, 6, 17), 11)
+        self.assertEqual(bitmap.count_bits(data, 5, 5), 0)
+
+
+class TestBitmaps(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        self.bitmaps = self.fs.bitmaps
+
+    def test_group_counts(self):
+        for group in range(self.fs.groups_count):
+            self.assertEqual(self.bitmaps.count_free_blocks(group),
+                             self.fs.gdt.free_blocks_count[group])
+            self.assertEqual(self.bitmaps.count_free_inodes(group),
+                             self.fs.gdt.free_inodes_count[group])
+
+    def test_inode_allocated(self):
+        self.assertTrue(self.bitmaps.is_inode_allocated(2))
+        inode_no = self.fs.resolve_path('/file1')[0]
+        self.assertTrue(self.bitmaps.is_inode_allocated(inode_no))
+        self.assertFalse(self.bitmaps.is_inode_allocated(
+            self.fs.sb.inodes_count))
+
+    def test_block_allocated(self):
+        inode = self.fs.open_inode(self.fs.resolve_path('/file1')[0])
+        for _, physical, length, _ in self.fs.extent_map(inode):
+            self.assertTrue(self.bitmaps.is_block_allocated(physical))
+            self.assertEqual(
+                self.bitmaps.count_allocated_blocks(physical, length), length)
+
+    def test_free_block_runs(self):
+        for group in range(self.fs.groups_count):
+            runs = list(self.bitmaps.free_block_runs(group))
+            self.assertEqual(sum(end - first for first, end in runs),
+                             self.bitmaps.count_free_blocks(group))
+            for first, end in runs:
+                self.assertFalse(self.bitmaps.is_block_allocated(first))
+                self.assertFalse(self.bitmaps.is_block_allocated(end - 1))
+
+    def test_group_has_super(self):
+        groups = [x for x in range(100)
+                  if bitmap.group_has_super(self.fs.sb, x)]
+        self.assertEqual(groups, [0, 1, 3, 5, 7, 9, 25, 27, 49, 81])
+
+    def test_block_uninit_group(self):
+        group = 1
+        self.bitmaps.has_csum = True
+        self.fs.gdt.flags[group] |= EXT4_BG_BLOCK_UNINIT
+        sb, gdt = self.fs.sb, self.fs.gdt
+        base = sb.first_data_block + group * sb.blocks_per_group
+        meta = bitmap.base_meta_blocks(self.fs, group)
+        self.assertTrue(meta > 0)
+        self.assertEqual(self.bitmaps.count_allocated_blocks(base, meta),
+                         meta)
+        for block in (gdt.block_bitmap[group], gdt.inode_bitmap[group],
+                      gdt.inode_table[group]):
+            if base <= block < base + sb.blocks_per_group:
+                self.assertTrue(self.bitmaps.is_block_allocated(block))
+        self.assertFalse(self.bitmaps.is_block_allocated(sb.blocks_count - 1))
+
+    def test_blocks_before_first_data_block(self):
+        self.assertEqual(self.fs.sb.first_data_block, 1)
+        self.assertTrue(self.bitmaps.is_block_allocated(0))
+        self.assertRaises(ValueError, self.bitmaps.block_group, 0)
+        self.assertEqual(self.bitmaps.block_group(1), (0, 0))
+        self.assertEqual(self.bitmaps.count_allocated_blocks(0, 1), 1)
+        self.assertEqual(self.bitmaps.count_allocated_blocks(0, 3),
+                         1 + self.bitmaps.count_allocated_blocks(1, 2))
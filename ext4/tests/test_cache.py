@@ -0,0 +1,80 @@
+import unittest
+
+from ext4 import FileSystem
+from ext4.cache import LRUCache
+from ext4.tests.config import PATH_TO_IMAGE
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_and_put(self):
+        cache = LRUCache(max_entries=2)
+        cache.put(1, 'one')
+        self.assertEqual(cache.get(1), 'one')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.stats.hits, 1)
+        self.assertEqual(cache.stats.misses, 1)
+
+    def test_entries_budget(self):
+        cache = LRUCache(max_entries=2)
+        cache.put(1, 'one')
+        cache.put(2, 'two')
+        cache.get(1)
+        cache.put(3, 'three')
+        self.assertTrue(1 in cache)
+        self.assertFalse(2 in cache)
+        self.assertTrue(3 in cache)
+        self.assertEqual(cache.stats.evictions, 1)
+
+    def test_bytes_budget(self):
+        cache = LRUCache(max_bytes=10, sizeof=len)
+        cache.put(1, b'12345')
+        cache.put(2, b'12345')
+        cache.put(3, b'1')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.bytes, 6)
+        cache.put(4, b'too long value')
+        self.assertFalse(4 in cache)
+
+    def test_pop(self):
+        cache = LRUCache(sizeof=len)
+        cache.put(1, b'123')
+        self.assertEqual(cache.pop(1), b'123')
+        self.assertEqual(cache.bytes, 0)
+        self.assertIsNone(cache.pop(1))
+
+
+class TestInodeCache(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+
+    def test_inode_is_cached(self):
+        root = self.fs.open_inode(2)
+        self.assertIs(self.fs.open_inode(2), root)
+        self.assertEqual(self.fs.inodes.stats.hits, 1)
+
+    def test_inode_cache_budget(self):
+        fs = FileSystem(open(PATH_TO_IMAGE, 'rb'), inode_cache_entries=1)
+        fs.open_inode(2)
+        fs.open_inode(11)
+        self.assertEqual(len(fs.inodes), 1)
+        self.assertEqual(fs.inodes.stats.evictions, 1)
+
+
+class TestExtentMapCache(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+
+    def test_extent_map_is_cached(self):
+        root = self.fs.open_inode(2)
+        extent_map = self.fs.extent_map(root)
+        self.assertIs(self.fs.extent_map(root), extent_map)
+        self.assertEqual(self.fs.extent_maps.stats.hits, 1)
+
+    def test_file_reads_reuse_map(self):
+        f = self.fs.open('/file1')
+        f.read()
+        misses = self.fs.extent_maps.stats.misses
+        f.read()
+        with f.open() as reader:
+            reader.read()
+        self.assertEqual(self.fs.extent_maps.stats.misses, misses)
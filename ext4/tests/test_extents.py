@@ -0,0 +1,127 @@
+import io
+import os
+import hashlib
+import tempfile
+import unittest
+
+from ext4.extents import ExtentMap
+from ext4.fileio import ExtentReader, copy_segments
+from ext4.tests.helpers import Leaf
+
+
+BLOCK_SIZE = 4
+# logical blocks: 0-1 -> 2-3, 2-3 is a hole, 4 -> 0
+IMAGE = b'EEEE' + b'....' + b'AAAA' + b'BBBB'
+LEAFS = [Leaf(4, 0, 1), Leaf(0, 2, 2)]
+
+
+class TestExtentMap(unittest.TestCase):
+    def setUp(self):
+        self.map = ExtentMap(LEAFS)
+
+    def test_sorted(self):
+        self.assertEqual(list(self.map), [(0, 2, 2, False), (4, 0, 1, False)])
+
+    def test_high_logical_block(self):
+        extent_map = ExtentMap([Leaf(2**31 + 5, 10, 3), Leaf(0, 2, 1)])
+        self.assertEqual(list(extent_map),
+                         [(0, 2, 1, False), (2**31 + 5, 10, 3, False)])
+        self.assertEqual(extent_map.find(2**31 + 6), 1)
+
+    def test_runs(self):
+        leafs = [Leaf(0, 10, 2), Leaf(2, 12, 3), Leaf(5, 20, 1),
+                 Leaf(7, 21, 1), Leaf(8, 22, 1, True)]
+        runs = list(ExtentMap(leafs).runs())
+        self.assertEqual(runs, [(0, 10, 5, False), (5, 20, 1, False),
+                                (7, 21, 1, False), (8, 22, 1, True)])
+
+    def test_segments(self):
+        segments = list(self.map.segments(BLOCK_SIZE, 30))
+        self.assertEqual(segments, [(2, 8), (None, 8), (0, 4), (None, 10)])
+        segments = list(self.map.segments(BLOCK_SIZE, 10))
+        self.assertEqual(segments, [(2, 8), (None, 2)])
+
+    def test_uninit_segments(self):
+        extent_map = ExtentMap([Leaf(0, 2, 1), Leaf(1, 3, 1, True)])
+        segments = list(extent_map.segments(BLOCK_SIZE, 8))
+        self.assertEqual(segments, [(2, 4), (None, 4)])
+
+    def test_find(self):
+        self.assertEqual(self.map.find(0), 0)
+        self.assertEqual(self.map.find(1), 0)
+        self.assertEqual(self.map.find(2), -1)
+        self.assertEqual(self.map.find(4), 1)
+        self.assertEqual(self.map.find(5), -1)
+
+    def test_next_mapped(self):
+        self.assertEqual(self.map.next_mapped(2), 4)
+        self.assertIsNone(self.map.next_mapped(4))
+
+
+class TestExtentReader(unittest.TestCase):
+    def open(self, size):
+        reader = ExtentReader(IMAGE, ExtentMap(LEAFS), BLOCK_SIZE, size)
+        return io.BufferedReader(reader)
+
+    def test_read_all(self):
+        with self.open(20) as f:
+            self.assertEqual(f.read(), b'AAAABBBB' + b'\x00' * 8 + b'EEEE')
+
+    def test_bounded_by_size(self):
+        with self.open(6) as f:
+            self.assertEqual(f.read(), b'AAAABB')
+
+    def test_read_uninit(self):
+        leafs = [Leaf(0, 2, 1), Leaf(1, 3, 1, True)]
+        reader = ExtentReader(IMAGE, ExtentMap(leafs), BLOCK_SIZE, 8)
+        with io.BufferedReader(reader) as f:
+            self.assertEqual(f.read(), b'AAAA\x00\x00\x00\x00')
+
+    def test_read_hole(self):
+        with self.open(20) as f:
+            f.seek(7)
+            self.assertEqual(f.read(3), b'B\x00\x00')
+            f.seek(15)
+            self.assertEqual(f.read(2), b'\x00E')
+
+
+class TestCopySegments(unittest.TestCase):
+    def setUp(self):
+        self.image = tempfile.TemporaryFile()
+        self.image.write(IMAGE)
+        self.image.flush()
+        self.out = tempfile.TemporaryFile()
+        self.segments = list(ExtentMap(LEAFS).segments(BLOCK_SIZE, 30))
+
+    def tearDown(self):
+        self.image.close()
+        self.out.close()
+
+    def read_output(self):
+        self.out.seek(0)
+        return self.out.read()
+
+    def test_copy(self):
+        count = copy_segments(self.out.fileno(), self.image.fileno(), IMAGE,
+                              self.segments, BLOCK_SIZE)
+        self.assertEqual(count, 30)
+        self.assertEqual(self.read_output(),
+                         b'AAAABBBB' + bytes(8) + b'EEEE' + bytes(10))
+
+    def test_copy_from_mmap_slices(self):
+        # copy syscalls fail on invalid descriptor, mmap slices are used
+        copy_segments(self.out.fileno(), -1, IMAGE, self.segments, BLOCK_SIZE)
+        self.assertEqual(self.read_output(),
+                         b'AAAABBBB' + bytes(8) + b'EEEE' + bytes(10))
+
+    def test_copy_with_digest(self):
+        digest = hashlib.sha256()
+        copy_segments(self.out.fileno(), self.image.fileno(), IMAGE,
+                      self.segments, BLOCK_SIZE, digest)
+        self.assertEqual(digest.digest(),
+                         hashlib.sha256(self.read_output()).digest())
+
+    def test_truncated_image(self):
+        copy_segments(self.out.fileno(), self.image.fileno(), IMAGE,
+                      [(3, 8), (None, 2)], BLOCK_SIZE)
+        self.assertEqual(self.read_output(), b'BBBB' + bytes(6))
@@ -1,3 +1,4 @@
+import tempfile
 import unittest
 
 from ext4 import FileSystem
@@ -93,3 +94,78 @@ class TestInternals(unittest.TestCase):
         self.assertTrue(b'file1' in data)
         self.assertTrue(b'file2' in data)
         self.assertTrue(b'file3' in data)
+
+    def test_copy_file(self):
+        inode = self.fs.open_inode(self.fs.resolve_path('/file1')[0])
+        with tempfile.TemporaryFile() as out:
+            count = self.fs.copy_file(inode, out.fileno())
+            out.seek(0)
+            self.assertEqual(count, inode.size)
+            self.assertEqual(out.read(),
+                             b''.join(self.fs.extract_file_bytes(inode)))
+
+    def test_close_with_views_held(self):
+        fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        fs.journal.read_block(0)
+        view = next(fs.read_runs(fs.open_inode(2)))
+        fs.__del__()
+        self.assertTrue(fs.image_file.closed)
+        view.release()
+
+    def test_data_fingerprint(self):
+        inode_no = self.fs.resolve_path('/file1')[0]
+        inode = self.fs.open_inode(inode_no)
+        copy = self.fs.read_inode(inode_no)
+        self.assertEqual(self.fs.data_fingerprint(inode),
+                         self.fs.data_fingerprint(copy))
+        copy.size -= 1
+        self.assertNotEqual(self.fs.data_fingerprint(inode),
+                            self.fs.data_fingerprint(copy))
+
+    def test_group_desc_table(self):
+        self.assertEqual(len(self.fs.gdt), self.fs.groups_count)
+        for index in range(self.fs.groups_count):
+            gd = self.fs.open_group_desc(index)
+            self.assertEqual(self.fs.gdt.inode_table[index], gd.inode_table)
+            self.assertEqual(self.fs.gdt.block_bitmap[index], gd.block_bitmap)
+            self.assertEqual(self.fs.gdt.inode_bitmap[index], gd.inode_bitmap)
+            self.assertEqual(self.fs.gdt.flags[index], gd.flags)
+
+
+class TestPathResolution(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+
+    def test_resolve_root(self):
+        self.assertEqual(self.fs.resolve_path('/'), (2, '.', '/'))
+
+    def test_resolve_path_is_cached(self):
+        resolved = self.fs.resolve_path('/dir1/file4')
+        self.assertEqual(resolved[1:], ('/dir1', 'file4'))
+        self.assertEqual(self.fs.resolve_path('dir1/./file4'), resolved)
+        self.assertEqual(self.fs.paths.stats.hits, 1)
+
+    def test_lookup_is_cached(self):
+        dir1 = self.fs.lookup(2, 'dir1')
+        self.assertNotEqual(dir1, 0)
+        self.assertEqual(self.fs.lookup(2, 'dir1'), dir1)
+        self.assertEqual(self.fs.dentries.stats.hits, 1)
+
+    def test_negative_lookup(self):
+        self.assertEqual(self.fs.lookup(2, 'no such file'), 0)
+        self.assertEqual(self.fs.lookup(2, 'no such file'), 0)
+        self.assertEqual(self.fs.dentries.stats.hits, 1)
+        with self.assertRaises(FileNotFoundError):
+            self.fs.open('/no such file')
+
+    def test_lookup_dots_in_hashed_directory(self):
+        big = self.fs.resolve_path('/dir2/big')[0]
+        dir2 = self.fs.resolve_path('/dir2')[0]
+        self.assertEqual(self.fs.lookup(big, '.'), big)
+        self.assertEqual(self.fs.lookup(big, '..'), dir2)
+        self.assertEqual(self.fs.resolve_path('/dir2/big/..')[0], dir2)
+        self.fs.open('/dir2/big')['..']
+
+    def test_lookup_missing_in_file(self):
+        file1 = self.fs.resolve_path('/file1')[0]
+        self.assertEqual(self.fs.lookup(file1, 'file1'), 0)
@@ -0,0 +1,72 @@
+import unittest
+from datetime import datetime
+
+from ext4 import FileSystem
+from ext4.consts import S_IFREG
+from ext4.filters import RestoreFilter, in_range, parse_size, parse_time
+from ext4.tests.config import PATH_TO_IMAGE
+
+
+class TestParsing(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size('1500'), 1500)
+        self.assertEqual(parse_size('64K'), 64 * 1024)
+        self.assertEqual(parse_size('1mb'), 1024**2)
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time('1500000000'), 1500000000)
+        self.assertEqual(parse_time('2h', now=10000), 10000 - 7200)
+        self.assertEqual(parse_time('3d', now=10**6), 10**6 - 3 * 86400)
+        self.assertEqual(parse_time('2017-07-14 02:40'),
+                         int(datetime(2017, 7, 14, 2, 40).timestamp()))
+
+    def test_in_range(self):
+        self.assertTrue(in_range(5, None))
+        self.assertTrue(in_range(5, (None, None)))
+        self.assertTrue(in_range(5, (5, 5)))
+        self.assertFalse(in_range(5, (6, None)))
+        self.assertFalse(in_range(5, (None, 4)))
+
+
+class TestRestoreFilter(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        self.inode = self.fs.open_inode(self.fs.resolve_path('/file1')[0])
+        self.content = b''.join(self.fs.extract_file_bytes(self.inode))
+
+    def test_no_conditions(self):
+        restore_filter = RestoreFilter()
+        self.assertTrue(restore_filter.match_deleted(0))
+        self.assertTrue(restore_filter.match_inode(self.inode))
+        self.assertTrue(restore_filter.match_data(self.fs, self.inode))
+
+    def test_deleted(self):
+        restore_filter = RestoreFilter(dtime=(100, 200))
+        self.assertTrue(restore_filter.match_deleted(150))
+        self.assertFalse(restore_filter.match_deleted(201))
+
+    def test_metadata(self):
+        size, mtime = self.inode.size, self.inode.mtime
+        uid = self.inode.uid
+        self.assertTrue(RestoreFilter(
+            size=(size, size), mtime=(mtime, None), uid=uid,
+            file_type='file').match_inode(self.inode))
+        self.assertTrue(RestoreFilter(file_type=S_IFREG)
+                        .match_inode(self.inode))
+        self.assertFalse(RestoreFilter(size=(size + 1, None))
+                         .match_inode(self.inode))
+        self.assertFalse(RestoreFilter(mtime=(None, mtime - 1))
+                         .match_inode(self.inode))
+        self.assertFalse(RestoreFilter(uid=uid + 1).match_inode(self.inode))
+        self.assertFalse(RestoreFilter(file_type='dir')
+                         .match_inode(self.inode))
+
+    def test_magic(self):
+        head = self.content[:4]
+        self.assertTrue(RestoreFilter(magic=[b'\x00', head])
+                        .match_data(self.fs, self.inode))
+        self.assertTrue(RestoreFilter(magic=[self.content[2:4]],
+                                      magic_offset=2)
+                        .match_data(self.fs, self.inode))
+        self.assertFalse(RestoreFilter(magic=[head + b'\xff' * 64])
+                         .match_data(self.fs, self.inode))
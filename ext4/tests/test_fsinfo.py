@@ -35,6 +35,12 @@ class TestDirectory(unittest.TestCase):
             entries = self.root.get_all()
         self.assertEqual(len(entries), 8)
 
+    def test_get_entries_is_lazy(self):
+        entries = self.root.get_entries()
+        self.assertFalse(isinstance(entries, list))
+        self.assertEqual(len(list(entries)), 8)
+        self.assertEqual(len(list(self.root.get_entries())), 8)
+
     def test_context_manager(self):
         with self.fs.open('/dir1') as d:
             entries = set((x.path for x in d.get_all()))
@@ -60,6 +66,19 @@ class TestDirectory(unittest.TestCase):
         self.assertFalse('/dir1' in entries)
         self.assertEqual(len(entries), 0)
 
+    def test_scandir(self):
+        entries = {e.name: e for e in self.root.scandir()}
+        self.assertEqual(len(entries), 8)
+        self.assertTrue(entries['dir1'].is_dir())
+        self.assertTrue(entries['file1'].is_file())
+        self.assertEqual(entries['file1'].path, '/file1')
+
+    def test_scandir_is_lazy(self):
+        entry = next(e for e in self.root.scandir() if e.name == 'file1')
+        self.assertFalse('size' in entry.__dict__)
+        self.assertEqual(entry.size, 15)
+        self.assertEqual(entry.inode_no, self.fs.open('/file1').inode_no)
+
     def test_iterator_content(self):
         entries = set((x.path for x in self.root))
         self.assertTrue('/.' in entries)
@@ -135,3 +154,23 @@ class TestFile(unittest.TestCase):
             f.unset_encoding()
             content = f.read()
             self.assertIsInstance(content, bytes)
+
+    def test_open(self):
+        with self.fs.open('/file1').open() as f:
+            self.assertEqual(f.read(), b'file 1 content\n')
+
+    def test_open_seek(self):
+        with self.fs.open('/file1').open() as f:
+            f.seek(5)
+            self.assertEqual(f.read(4), b'1 co')
+            self.assertEqual(f.tell(), 9)
+            f.seek(-3, 2)
+            self.assertEqual(f.read(), b'nt\n')
+            self.assertEqual(f.read(), b'')
+
+    def test_open_readinto(self):
+        with self.fs.open('/dir1/file4').open() as f:
+            buffer = bytearray(100)
+            count = f.readinto(buffer)
+            self.assertEqual(count, 15)
+            self.assertEqual(bytes(buffer[:count]), b'file 4 content\n')
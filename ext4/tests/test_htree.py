@@ -0,0 +1,64 @@
+import unittest
+import struct
+
+from ext4.consts import *
+from ext4.htree import dirhash, read_dx_entries, find_leaf_blocks, \
+                       DX_ROOT_INFO_OFFSET
+
+
+def make_dx_root(hash_version, entries, block_size=1024):
+    '''Build dx_root block with entries [(hash, block), ...]'''
+    block = struct.pack('<IHBB4s', 2, 12, 1, 2, b'.')
+    block += struct.pack('<IHBB4s', 2, block_size - 12, 2, 2, b'..')
+    block += struct.pack('<IBBBB', 0, hash_version, 8, 0, 0)
+    block += struct.pack('<HHI', 100, len(entries), entries[0][1])
+    for hash_, leaf in entries[1:]:
+        block += struct.pack('<II', hash_, leaf)
+    return block + b'\x00' * (block_size - len(block))
+
+
+class TestDirHash(unittest.TestCase):
+    def test_hash_is_even(self):
+        for version in range(DX_HASH_TEA_UNSIGNED + 1):
+            self.assertEqual(dirhash(b'some_file', version) & 1, 0)
+
+    def test_hash_versions_differ(self):
+        hashes = set(dirhash(b'some_file', v) for v in range(3))
+        self.assertEqual(len(hashes), 3)
+
+    def test_signedness(self):
+        name = 'файл'.encode()
+        self.assertNotEqual(dirhash(name, DX_HASH_TEA),
+                            dirhash(name, DX_HASH_TEA_UNSIGNED))
+        self.assertEqual(dirhash(b'ascii', DX_HASH_HALF_MD4),
+                         dirhash(b'ascii', DX_HASH_HALF_MD4_UNSIGNED))
+
+    def test_zero_seed_is_default(self):
+        self.assertEqual(dirhash(b'name', DX_HASH_TEA, (0, 0, 0, 0)),
+                         dirhash(b'name', DX_HASH_TEA))
+
+    def test_unknown_version(self):
+        with self.assertRaises(ValueError):
+            dirhash(b'name', 42)
+
+
+class TestDxRoot(unittest.TestCase):
+    def test_read_entries(self):
+        root = make_dx_root(DX_HASH_TEA, [(0, 1), (100, 2), (200, 3)])
+        hashes, blocks = read_dx_entries(root, DX_ROOT_INFO_OFFSET + 8)
+        self.assertEqual(hashes, [0, 100, 200])
+        self.assertEqual(blocks, [1, 2, 3])
+
+    def test_find_leaf_block(self):
+        target = dirhash(b'name', DX_HASH_TEA)
+        entries = [(0, 1), (target, 2), (target + 2, 3)]
+        root = make_dx_root(DX_HASH_TEA, entries)
+        leafs = find_leaf_blocks(b'name', lambda x: root, None, False)
+        self.assertEqual(list(leafs), [2])
+
+    def test_find_colliding_leafs(self):
+        target = dirhash(b'name', DX_HASH_TEA)
+        entries = [(0, 1), (target, 2), (target | 1, 3), (target + 4, 4)]
+        root = make_dx_root(DX_HASH_TEA, entries)
+        leafs = find_leaf_blocks(b'name', lambda x: root, None, False)
+        self.assertEqual(list(leafs), [2, 3])
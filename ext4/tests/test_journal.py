@@ -0,0 +1,343 @@
+import os
+import pickle
+import struct
+import tempfile
+import unittest
+
+from ext4 import FileSystem
+from ext4.extents import ExtentMap
+from ext4.journal import Journal, HeaderTable, COMMIT_UNCHECKED
+from ext4.jmap import JournalMap, build_journal_map, read_journal_map, \
+                      write_journal_map
+from ext4 import jmap
+from ext4.jstructs import *
+from ext4.utils import crc32c
+from ext4.tests.config import PATH_TO_IMAGE
+from ext4.tests.helpers import Leaf
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        self.journal = self.fs.journal
+        inode = self.fs.open_inode(self.fs.sb.journal_inum)
+        self.journal_bytes = b''.join(self.fs.extract_file_bytes(inode))
+
+    def test_superblock(self):
+        self.assertEqual(self.journal.sb.header.magic, JBD2_MAGIC)
+        self.assertEqual(self.journal.sb.blocksize, self.fs.sb.block_size)
+        self.assertEqual(self.journal.blocks_count, self.journal.sb.maxlen)
+
+    def test_read_block(self):
+        block_size = self.journal.block_size
+        for index in (0, 1, self.journal.blocks_count - 1):
+            block = self.journal.read_block(index)
+            self.assertIsInstance(block, bytes)
+            start = index * block_size
+            self.assertEqual(block, self.journal_bytes[start:start+block_size])
+
+    def test_parallel_scan(self):
+        table = self.journal.scan_parallel(2, PATH_TO_IMAGE)
+        self.assertEqual(list(table.index), list(self.journal.scan().index))
+        parallel = self.journal.create_journal_map(jobs=2,
+                                                   image_path=PATH_TO_IMAGE)
+        self.assertEqual(parallel, self.journal.create_journal_map())
+
+    def test_unmapped_block(self):
+        with self.assertRaises(ValueError):
+            self.journal.read_block(self.journal.blocks_count + 10)
+
+    def test_find_header_blocks(self):
+        found = [index for index, _, _ in self.journal.find_header_blocks()]
+        expected = [index for index in range(self.journal.blocks_count)
+                    if self.journal.read_block(index)[:4] == JBD2_MAGIC_BYTES]
+        self.assertEqual(found, expected)
+        self.assertEqual(found[0], 0)
+
+
+def descriptor(tags, block_size=1024):
+    block = bytearray(block_size)
+    J_HEADER.pack_into(block, 0, JBD2_MAGIC, BlockType.descriptor, 1)
+    offset = J_HEADER_LENGTH
+    for tag in tags:
+        block[offset:offset + len(tag)] = tag
+        offset += len(tag)
+    return bytes(block)
+
+
+def bare_journal(tag, flags_at, high_at, tail_size=0):
+    journal = Journal.__new__(Journal)
+    journal.tag, journal.tag_flags, journal.tag_high = tag, flags_at, high_at
+    journal.tail_size = tail_size
+    return journal
+
+
+class TestDescriptorTags(unittest.TestCase):
+    def test_tags_v3(self):
+        same, last = JournalDescFlags.uuid_omitted, JournalDescFlags.last_tag
+        block = descriptor([J_TAG3.pack(10, 0, 0, 0) + bytes(16),
+                            J_TAG3.pack(11, same, 1, 0),
+                            J_TAG3.pack(12, same | last, 0, 0),
+                            J_TAG3.pack(13, same, 0, 0)])
+        journal = bare_journal(J_TAG3, 1, 2, J_TAIL_LENGTH)
+        self.assertEqual(journal.read_tags(block), [10, 11 | 1 << 32, 12])
+
+    def test_tags_32bit(self):
+        same, last = JournalDescFlags.uuid_omitted, JournalDescFlags.last_tag
+        block = descriptor([J_TAG.pack(5, 0, 0) + bytes(16),
+                            J_TAG.pack(6, 0, 0) + bytes(16),
+                            J_TAG.pack(7, 0, same | last)])
+        journal = bare_journal(J_TAG, 2, None)
+        self.assertEqual(journal.read_tags(block), [5, 6, 7])
+
+    def test_tags_without_last(self):
+        block = descriptor([J_TAG.pack(5, 0, JournalDescFlags.uuid_omitted)],
+                           block_size=J_HEADER_LENGTH + 2 * J_TAG.size)
+        journal = bare_journal(J_TAG, 2, None)
+        self.assertEqual(journal.read_tags(block), [5, 0])
+
+
+class TestJournalMap(unittest.TestCase):
+    COPIES = ([1, 3, 2, 2], [10, 12, 11, 13], [100, 100, 101, 100])
+
+    def test_most_recent_first(self):
+        journal_map = build_journal_map(*self.COPIES)
+        self.assertEqual(journal_map, {100: [12, 13, 10], 101: [11]})
+        self.assertTrue(100 in journal_map)
+        self.assertFalse(102 in journal_map)
+        self.assertEqual(list(journal_map), [100, 101])
+
+    def test_without_numpy(self):
+        numpy, jmap.numpy = jmap.numpy, None
+        try:
+            journal_map = build_journal_map(*self.COPIES)
+        finally:
+            jmap.numpy = numpy
+        self.assertEqual(journal_map, {100: [12, 13, 10], 101: [11]})
+
+    def test_negative_ages(self):
+        journal_map = build_journal_map([-5, 0, -1], [1, 2, 3], [7, 7, 7])
+        self.assertEqual(journal_map[7], [2, 3, 1])
+
+    def test_empty(self):
+        self.assertEqual(len(build_journal_map([], [], [])), 0)
+        with self.assertRaises(KeyError):
+            JournalMap()[1]
+
+
+class TestJournalIndex(unittest.TestCase):
+    SIGNATURE = (bytes(range(16)), 1500000000, 1024, 7, 0, 0)
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'image.jmap')
+        self.map = build_journal_map(*TestJournalMap.COPIES)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        write_journal_map(self.path, self.map, self.SIGNATURE)
+        loaded = read_journal_map(self.path, self.SIGNATURE)
+        self.assertIsInstance(loaded.copies, memoryview)
+        self.assertEqual(loaded, self.map)
+        self.assertEqual(pickle.loads(pickle.dumps(loaded)), self.map)
+
+    def test_other_signature(self):
+        write_journal_map(self.path, self.map, self.SIGNATURE)
+        changed = self.SIGNATURE[:3] + (8,) + self.SIGNATURE[4:]
+        self.assertIsNone(read_journal_map(self.path, changed))
+
+    def test_missing_or_broken(self):
+        self.assertIsNone(read_journal_map(self.path, self.SIGNATURE))
+        write_journal_map(self.path, self.map, self.SIGNATURE)
+        with open(self.path, 'r+b') as index:
+            index.truncate(os.path.getsize(self.path) - 1)
+        self.assertIsNone(read_journal_map(self.path, self.SIGNATURE))
+
+    def test_filesystem_journal_map(self):
+        fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        built = fs.journal_map(index_path=self.path)
+        self.assertTrue(os.path.exists(self.path))
+        loaded = fs.journal_map(index_path=self.path)
+        self.assertIsInstance(loaded.blocks, memoryview)
+        self.assertEqual(loaded, built)
+
+    def test_parallel_scan_by_image_path(self):
+        # image is opened by a name which is gone, workers need image_path
+        link = os.path.join(self.dir.name, 'image.dd')
+        os.symlink(PATH_TO_IMAGE, link)
+        fs = FileSystem(open(link, 'rb'))
+        os.remove(link)
+        serial = fs.journal_map()
+        self.assertEqual(fs.journal_map(jobs=2, image_path=PATH_TO_IMAGE),
+                         serial)
+
+
+class TestHeaderTable(unittest.TestCase):
+    def test_extend(self):
+        first, second = HeaderTable(), HeaderTable()
+        first.append(1, BlockType.descriptor, 5, values=[100, 101])
+        first.append(4, BlockType.commit_record, 5)
+        second.append(5, BlockType.revocation_record, 6, values=[101])
+        first.extend(second)
+        self.assertEqual(list(first.index), [1, 4, 5])
+        self.assertEqual(list(first.payload(0)), [100, 101])
+        self.assertEqual(list(first.payload(1)), [])
+        self.assertEqual(list(first.payload(2)), [101])
+
+
+J_BLOCK_SIZE = 1024
+J_BLOCKS = 16
+UUID = bytes(range(16))
+SAME, LAST = JournalDescFlags.uuid_omitted, JournalDescFlags.last_tag
+
+
+class JournalBuilder:
+    '''Builds journal image: superblock and blocks put by index.'''
+    def __init__(self, sequence, csum=False):
+        self.csum = csum
+        self.blocks = [bytes(J_BLOCK_SIZE)] * J_BLOCKS
+        features = JBD2_FEATURE_INCOMPAT_CSUM_V3 if csum else 0
+        sb = J_HEADER.pack(JBD2_MAGIC, BlockType.journal_sb_v2, 0) + \
+            struct.pack('>9I', J_BLOCK_SIZE, J_BLOCKS, 1, sequence, 0, 0,
+                        0, features, 0) + UUID
+        self.put(0, sb)
+
+    def put(self, index, data):
+        self.blocks[index] = data + bytes(J_BLOCK_SIZE - len(data))
+
+    def header(self, blocktype, sequence):
+        return J_HEADER.pack(JBD2_MAGIC, blocktype, sequence)
+
+    def descriptor(self, index, sequence, blocknrs):
+        tags = b''
+        for position, blocknr in enumerate(blocknrs):
+            flags = (SAME if position else 0) | \
+                (LAST if position == len(blocknrs) - 1 else 0)
+            if self.csum:
+                tags += J_TAG3.pack(blocknr, flags, 0, 0)
+            else:
+                tags += J_TAG.pack(blocknr, 0, flags)
+            if not position:
+                tags += UUID
+        self.put(index, self.header(BlockType.descriptor, sequence) + tags)
+
+    def revoke(self, index, sequence, blocknrs):
+        records = b''.join(J_REVOKE_32.pack(x) for x in blocknrs)
+        count = J_REVOKE_HEADER_LENGTH + len(records)
+        self.put(index, self.header(BlockType.revocation_record, sequence) +
+                 struct.pack('>I', count) + records)
+
+    def commit(self, index, sequence):
+        block = bytearray(J_BLOCK_SIZE)
+        block[:J_HEADER_LENGTH] = self.header(BlockType.commit_record,
+                                              sequence)
+        if self.csum:
+            checksum = crc32c(block, crc32c(UUID))
+            struct.pack_into('>I', block, J_COMMIT_CHKSUM_OFFSET, checksum)
+        self.put(index, bytes(block))
+
+    def journal(self):
+        image = b''.join(self.blocks)
+        return Journal(image, ExtentMap([Leaf(0, 0, J_BLOCKS)]), J_BLOCK_SIZE)
+
+
+class TestJournalWalk(unittest.TestCase):
+    def build(self, csum=False):
+        builder = JournalBuilder(5, csum)
+        builder.descriptor(1, 5, [100, 101])
+        builder.commit(4, 5)
+        builder.descriptor(5, 6, [100])
+        builder.revoke(7, 6, [101])
+        builder.commit(8, 6)
+        # torn transaction without commit
+        builder.descriptor(9, 7, [102])
+        return builder
+
+    def walk(self, journal):
+        return [(sequence, list(jrn), list(disc), list(revoked))
+                for sequence, jrn, disc, revoked in journal.walk()]
+
+    def test_walk(self):
+        walked = self.walk(self.build().journal())
+        self.assertEqual(walked, [(5, [2, 3], [100, 101], []),
+                                  (6, [6], [100], [101])])
+
+    def test_scan_ranges(self):
+        journal = self.build().journal()
+        table = HeaderTable()
+        for first in range(0, J_BLOCKS, 3):
+            table.extend(journal.scan(first, first + 3))
+        whole = journal.scan()
+        self.assertEqual(list(table.index), list(whole.index))
+        self.assertEqual(list(table.values), list(whole.values))
+        self.assertEqual(list(table.offsets), list(whole.offsets))
+
+    def test_journal_map(self):
+        journal = self.build().journal()
+        self.assertEqual(journal.create_journal_map(), {100: [6, 2]})
+        self.assertEqual(journal.create_journal_map(full_sweep=True),
+                         {100: [6, 2], 101: [3], 102: [10]})
+
+    def test_wrap(self):
+        builder = JournalBuilder(5)
+        builder.descriptor(13, 5, [100, 101])
+        builder.commit(1, 5)
+        builder.descriptor(2, 6, [100])
+        builder.commit(4, 6)
+        walked = self.walk(builder.journal())
+        self.assertEqual(walked, [(5, [14, 15], [100, 101], []),
+                                  (6, [3], [100], [])])
+
+    def test_resync_after_broken_chain(self):
+        builder = self.build()
+        builder.put(4, bytes(J_BLOCK_SIZE))     # lost commit of 5
+        walked = list(builder.journal().walk())
+        self.assertEqual([x[0] for x in walked], [6])
+
+    def test_commit_checksum(self):
+        builder = self.build(csum=True)
+        self.assertEqual(len(list(builder.journal().walk())), 2)
+        block = bytearray(builder.blocks[8])
+        block[100] ^= 1
+        builder.put(8, bytes(block))
+        self.assertEqual([x[0] for x in builder.journal().walk()], [5])
+
+    def test_commit_checked_by_walk(self):
+        builder = self.build(csum=True)
+        block = bytearray(builder.blocks[8])
+        block[100] ^= 1
+        builder.put(8, bytes(block))
+        # stray commit without descriptor is never reached by walk
+        builder.commit(11, 9)
+        journal = builder.journal()
+        table = journal.scan()
+        commits = [row for row in range(len(table))
+                   if table.blocktype[row] == BlockType.commit_record]
+        self.assertEqual([table.valid[row] for row in commits],
+                         [COMMIT_UNCHECKED] * 3)
+        self.assertEqual([x[0] for x in journal.walk(table)], [5])
+        self.assertEqual([table.valid[row] for row in commits],
+                         [1, 0, COMMIT_UNCHECKED])
+
+    def test_sequence_wrap(self):
+        builder = JournalBuilder(0xFFFFFFFF)
+        builder.descriptor(1, 0xFFFFFFFF, [100])
+        builder.commit(3, 0xFFFFFFFF)
+        builder.descriptor(4, 0, [100])
+        builder.commit(6, 0)
+        self.assertEqual(builder.journal().create_journal_map(),
+                         {100: [5, 2]})
+
+
+class TestCommitBlock(unittest.TestCase):
+    def test_layout(self):
+        self.assertEqual(JournalCommitBlock._size, J_COMMIT_LENGTH)
+        block = bytearray(J_COMMIT_LENGTH)
+        block[:J_HEADER_LENGTH] = J_HEADER.pack(JBD2_MAGIC, 2, 7)
+        struct.pack_into('>QI', block, 48, 1500000000, 42)
+        commit = JournalCommitBlock(bytes(block))
+        self.assertEqual(commit.header.sequence, 7)
+        self.assertEqual((commit.commit_sec, commit.commit_nsec),
+                         (1500000000, 42))
@@ -0,0 +1,114 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from ext4 import FileSystem
+from ext4 import restore
+from ext4.tests.config import PATH_TO_IMAGE
+
+
+class TestTriage(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        self.inode = self.fs.open_inode(self.fs.resolve_path('/file1')[0])
+
+    def test_live_blocks(self):
+        live = restore.LiveBlocks(self.fs)
+        for start, length in self.fs.physical_runs(self.inode):
+            self.assertEqual(live.count(start, length), length)
+            self.assertEqual(live.count(start, 1), 1)
+        self.assertEqual(live.count(self.fs.sb.blocks_count, 10), 0)
+
+    def test_live_blocks_partial(self):
+        live = restore.LiveBlocks.__new__(restore.LiveBlocks)
+        live.starts, live.ends = [10, 30], [20, 40]
+        live.prefix = [0, 10, 20]
+        self.assertEqual(live.count(0, 100), 20)
+        self.assertEqual(live.count(15, 20), 10)
+        self.assertEqual(live.count(20, 10), 0)
+        self.assertEqual(live.count(39, 5), 1)
+
+    def test_assess_live_file(self):
+        total, free = restore.assess_inode(self.fs, self.inode)
+        self.assertTrue(total > 0)
+        self.assertEqual(free, 0)
+        self.assertEqual(restore.recoverable_fraction(total, free), 0.0)
+
+    def test_assess_broken_inode(self):
+        inode = self.fs.read_inode(self.fs.resolve_path('/file1')[0])
+        inode.block = bytes(len(inode.block))
+        self.assertIsNone(restore.assess_inode(self.fs, inode))
+
+    def test_assess_high_logical_block(self):
+        inode = self.fs.read_inode(self.fs.resolve_path('/file1')[0])
+        start = self.fs.physical_runs(inode)[0][0]
+        header = struct.pack('<HHHHI', 0xF30A, 1, 4, 0, 0)
+        leaf = struct.pack('<IHHI', 2**31, 1, 0, start)
+        inode.block = (header + leaf).ljust(len(inode.block), b'\0')
+        self.assertEqual(restore.assess_inode(self.fs, inode), (0, 0))
+
+
+class TestParallelSearch(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        self.journal_map = restore.journal_map
+        restore.journal_map = self.fs.journal.create_journal_map()
+
+    def tearDown(self):
+        restore.journal_map = self.journal_map
+
+    def descriptors(self, candidates):
+        return [(addr, dtime, [x.block for x, _, _ in predecessors])
+                for addr, dtime, predecessors in candidates]
+
+    def test_predecessors_without_journal_copies(self):
+        restore.journal_map = {}
+        inode = self.fs.read_inode(2)
+        self.assertEqual(restore.find_predecessors(self.fs, [(2, inode)]), {})
+
+    def test_same_order_as_serial(self):
+        serial = restore.find_candidates(self.fs)
+        parallel = restore.find_candidates_parallel(self.fs, 2, PATH_TO_IMAGE)
+        self.assertEqual(self.descriptors(parallel), self.descriptors(serial))
+
+
+class TestRestore(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        self.fs.journal_map = lambda *args: {}
+        self.find_candidates = restore.find_candidates
+        self.journal_map = restore.journal_map
+
+    def tearDown(self):
+        restore.find_candidates = self.find_candidates
+        restore.journal_map = self.journal_map
+
+    def restore(self, predecessors):
+        restore.find_candidates = lambda *args, **kwargs: \
+            [(0x1000, 0, predecessors)]
+        with tempfile.TemporaryDirectory() as out:
+            result = restore.restore_deleted_files(self.fs, out)
+            return result, sorted(os.listdir(out))
+
+    def test_empty_copies_are_not_counted(self):
+        inode_no = self.fs.resolve_path('/file1')[0]
+        inode = self.fs.read_inode(inode_no)
+        empty = self.fs.read_inode(inode_no)
+        empty.size = 0
+        (restored, skipped, _), names = self.restore(
+            [(empty, (0, 0), None),
+             (inode, (1, 1), self.fs.data_fingerprint(inode))])
+        self.assertEqual((restored, skipped), (1, 0))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[0].endswith(' - 0'))
+        self.assertEqual(names[1], restore.MANIFEST_NAME)
+
+    def test_duplicate_content_is_removed(self):
+        inode_no = self.fs.resolve_path('/file1')[0]
+        inode = self.fs.read_inode(inode_no)
+        (restored, _, _), names = self.restore(
+            [(inode, (1, 1), b'first'), (inode, (1, 1), b'second'),
+             (inode, (1, 1), b'first')])
+        self.assertEqual(restored, 1)
+        self.assertEqual(len(names), 2)
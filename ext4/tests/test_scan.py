@@ -0,0 +1,74 @@
+import unittest
+
+from ext4 import FileSystem
+from ext4 import scan
+from ext4.tests.config import PATH_TO_IMAGE
+
+
+def naive_deleted_inodes(fs):
+    for index in range(1, fs.sb.inodes_count + 1):
+        inode = fs.read_inode(index)
+        if (inode.dtime != 0 or inode.links_count == 0) \
+                and inode.block != b'\x00' * len(inode.block):
+            yield index
+
+
+class TestScan(unittest.TestCase):
+    def setUp(self):
+        self.fs = FileSystem(open(PATH_TO_IMAGE, 'rb'))
+        self.expected = list(naive_deleted_inodes(self.fs))
+
+    def test_scan_deleted_inodes(self):
+        found = [index for index, _ in scan.scan_deleted_inodes(self.fs)]
+        self.assertEqual(found, self.expected)
+
+    def test_scan_without_numpy(self):
+        numpy, scan.numpy = scan.numpy, None
+        try:
+            found = [i for i, _ in scan.scan_deleted_inodes(self.fs)]
+        finally:
+            scan.numpy = numpy
+        self.assertEqual(found, self.expected)
+
+    def test_inode_ranges(self):
+        per_group = self.fs.sb.inodes_per_group
+        for group, first, end in scan.iter_inode_ranges(self.fs):
+            self.assertTrue(0 <= first < end <= per_group)
+
+    def test_allocated_inode_ranges(self):
+        per_group = self.fs.sb.inodes_per_group
+        allocated = set(group * per_group + index + 1
+                        for group, first, end
+                        in scan.iter_inode_ranges(self.fs, True)
+                        for index in range(first, end))
+        self.assertTrue(2 in allocated)
+        self.assertTrue(self.fs.resolve_path('/file1')[0] in allocated)
+        self.assertEqual(len(allocated),
+                         self.fs.sb.inodes_count - self.fs.sb.free_inodes_count)
+
+    def test_find_live(self):
+        size = self.fs.sb.inode_size
+        table = bytearray(size * 3)
+        table[12] = 1                   # ctime of first inode
+        table[size + 12] = 1            # ctime of deleted second inode
+        table[size + 20] = 1
+        self.assertEqual(scan.find_live(bytes(table), size), [0])
+
+    def test_find_live_without_numpy(self):
+        numpy, scan.numpy = scan.numpy, None
+        try:
+            start = self.fs.gdt.inode_table[0] * self.fs.sb.block_size
+            table = self.fs.read(start, self.fs.sb.block_size)
+            live = scan.find_live(table, self.fs.sb.inode_size)
+        finally:
+            scan.numpy = numpy
+        self.assertTrue(1 in live)      # root directory, inode 2
+
+    def test_find_deleted(self):
+        size = self.fs.sb.inode_size
+        table = bytearray(size * 3)
+        table[size + 20] = 1            # dtime of second inode
+        table[size + 40] = 1            # i_block of second inode
+        table[2 * size + 40] = 1        # i_block of live third inode
+        table[2 * size + 26] = 1        # links_count of third inode
+        self.assertEqual(scan.find_deleted(bytes(table), size), [1])
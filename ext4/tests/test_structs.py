@@ -8,7 +8,7 @@ from ext4.tests.config import PATH_TO_IMAGE, IMAGE_SIZE, SUPERBLOCK_OFFSET, \
 
 
 def test_hi_and_lo_attributes(struct, asserter):
-    for attr in struct.__dict__:
+    for attr in dir(struct):
         if attr.endswith('_lo') or attr.endswith('_hi'):
             asserter.assertTrue(hasattr(struct, attr[:-3]))
         if attr.endswith('_lo'):
@@ -76,3 +76,15 @@ class TestGroupDescriptor(unittest.TestCase):
         # I've created 5 dirs (root, dir1, dir2, dir3, lost+found), so
         # they should be there:
         self.assertEqual(first.used_dirs_count + second.used_dirs_count, 5)
+
+
+class TestInode(unittest.TestCase):
+    def test_16_bit_halves(self):
+        data = bytearray(INODE_SIZE)
+        data[2:4] = (0x8005).to_bytes(2, 'little')      # uid_lo
+        data[24:26] = (0x0007).to_bytes(2, 'little')    # gid_lo
+        data[120:122] = (0x0001).to_bytes(2, 'little')  # uid_hi
+        data[122:124] = (0x0002).to_bytes(2, 'little')  # gid_hi
+        inode = Inode(bytes(data))
+        self.assertEqual(inode.uid, 0x18005)
+        self.assertEqual(inode.gid, 0x20007)
@@ -70,6 +70,12 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(len(handled), len(data))
         self.assertEqual(handled, data)
 
+    def test_iter_zeros(self):
+        chunks = list(iter_zeros(ZERO_CHUNK_SIZE + 10))
+        self.assertEqual([len(x) for x in chunks], [ZERO_CHUNK_SIZE, 10])
+        self.assertFalse(any(chunks[1]))
+        self.assertEqual(list(iter_zeros(0)), [])
+
 
 class TestDisassemblePath(unittest.TestCase):
     def test_disassemble_path(self):
@@ -91,3 +97,20 @@ class TestDisassemblePath(unittest.TestCase):
     def test_disassemble_without_slash(self):
         path = list(disassemble_path('a/b/c/d'))
         self.assertEqual(path, ['a', 'b', 'c', 'd'])
+
+
+class TestCrc32c(unittest.TestCase):
+    def test_check_value(self):
+        self.assertEqual(crc32c(b'123456789') ^ 0xFFFFFFFF, 0xE3069283)
+
+    def test_continued(self):
+        self.assertEqual(crc32c(b'6789', crc32c(b'12345')),
+                         crc32c(b'123456789'))
+
+    def test_long_input(self):
+        data = bytes(range(256)) * 16 + b'tail'
+        crc = 0xFFFFFFFF
+        for byte in data:
+            crc = CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+        self.assertEqual(crc32c(data), crc)
+        self.assertEqual(crc32c(memoryview(data)[3:]), crc32c(data[3:]))
@@ -0,0 +1,95 @@
+'''C types used to describe layouts of ext4 on-disk structures.
+Each type knows its `struct` format character and how many items
+of this type the field holds, so whole structure can be compiled into
+one struct.Struct.
+'''
+
+import struct
+
+little_endian = '<'
+big_endian = '>'
+
+
+class CType:
+    '''Base of all field types. count > 1 declares an array field,
+    which is decoded into tuple.
+    '''
+    format_char = None
+
+    def __init__(self, count=1):
+        self.count = count
+
+    @property
+    def format(self):
+        if self.count == 1:
+            return self.format_char
+        return str(self.count) + self.format_char
+
+    @property
+    def is_array(self):
+        return self.count != 1
+
+    @property
+    def bits(self):
+        '''Width of one item in bits.'''
+        return struct.calcsize(self.format_char) * 8
+
+
+class UnsignedChar(CType):
+    format_char = 'B'
+
+
+class Short(CType):
+    format_char = 'h'
+
+
+class UnsignedShort(CType):
+    format_char = 'H'
+
+
+class Integer(CType):
+    format_char = 'i'
+
+
+class UnsignedInteger(CType):
+    format_char = 'I'
+
+
+class Long(CType):
+    format_char = 'l'
+
+
+class LongLong(CType):
+    format_char = 'q'
+
+
+class CString(CType):
+    '''Fixed-size bytes field. Decoded as single bytes object.'''
+    format_char = 's'
+
+    def __init__(self, length):
+        super().__init__(length)
+
+    @property
+    def format(self):
+        return str(self.count) + self.format_char
+
+    @property
+    def is_array(self):
+        return False
+
+
+class Padding(CType):
+    '''Unused bytes. They are skipped and never decoded.'''
+    format_char = 'x'
+
+    def __init__(self, length):
+        super().__init__(length)
+
+    @property
+    def format(self):
+        return str(self.count) + self.format_char
+
+    @property
+    def is_array(self):
+        return False
@@ -1,6 +1,12 @@
 import os
+import struct
 from math import ceil
 
+try:
+    import crc32c as _crc32c_module
+except ImportError:
+    _crc32c_module = None
+
 from ext4.consts import S_IFDIR, S_IRUSR, S_IWUSR, S_IXUSR, S_IRGRP, \
                         S_IWGRP, S_IXGRP, S_IROTH, S_IWOTH, S_IXOTH
 
@@ -44,13 +50,14 @@ def format_file_mode_num(mode):
     return num_mode
 
 
-def convert_ints_to_long(low, high):
-    '''Low - lower bits of result, high - higher bits of result'''
+def convert_ints_to_long(low, high, bits=32):
+    '''Low - lower bits of result, high - higher bits of result,
+    bits - width of each half'''
     if low < 0:
-        low += 2**32
+        low += 2**bits
     if high < 0:
-        high += 2**32
-    return low + (high << 32)
+        high += 2**bits
+    return low + (high << bits)
 
 
 def padded_with_zeroes(data, length):
@@ -60,6 +67,18 @@ def padded_with_zeroes(data, length):
     return data + b'\x00' * (length - len(data))
 
 
+ZERO_CHUNK_SIZE = 1024**2
+ZEROS = bytes(ZERO_CHUNK_SIZE)
+
+
+def iter_zeros(count):
+    '''Yields zero bytes, count in total, by chunks of ZERO_CHUNK_SIZE'''
+    while count > 0:
+        chunk = min(count, ZERO_CHUNK_SIZE)
+        yield ZEROS[:chunk]
+        count -= chunk
+
+
 def del_trailing_zeros(data):
     '''Delete zeroes at the end of the data'''
     i = _find_trailing_zeros_index(data)
@@ -93,3 +112,44 @@ def chunk(iterable, chunk_size):
     '''split iterable to chunks with specified size'''
     for x in range(ceil(len(iterable) / chunk_size)):
         yield iterable[x*chunk_size : (x+1)*chunk_size]
+
+
+def _crc32c_tables():
+    '''Tables of slice-by-8 CRC32c: tables[0] is classic byte table,
+    tables[k][byte] is CRC of byte followed by k zero bytes.'''
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ (0x82F63B78 if crc & 1 else 0)
+        table.append(crc)
+    tables = [table]
+    for _ in range(7):
+        tables.append([(x >> 8) ^ table[x & 0xFF] for x in tables[-1]])
+    return tables
+
+
+CRC32C_TABLES = _crc32c_tables()
+CRC32C_TABLE = CRC32C_TABLES[0]
+_CRC32C_WORDS = struct.Struct('<II')
+
+
+def crc32c(data, crc=0xFFFFFFFF):
+    '''CRC32c (Castagnoli) of data without final inversion, continued
+    from crc, the same way as kernel crc32c() used by ext4 and jbd2.
+    Computed by crc32c module if it is installed, otherwise 8 bytes at a
+    time by slice-by-8 tables.'''
+    if _crc32c_module is not None:
+        return _crc32c_module.crc32c(data, crc ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+    t0, t1, t2, t3, t4, t5, t6, t7 = CRC32C_TABLES
+    data = bytes(data)
+    end = len(data) & ~7
+    for low, high in _CRC32C_WORDS.iter_unpack(data[:end]):
+        low ^= crc
+        crc = t7[low & 0xFF] ^ t6[low >> 8 & 0xFF] ^ \
+            t5[low >> 16 & 0xFF] ^ t4[low >> 24] ^ \
+            t3[high & 0xFF] ^ t2[high >> 8 & 0xFF] ^ \
+            t1[high >> 16 & 0xFF] ^ t0[high >> 24]
+    for byte in data[end:]:
+        crc = t0[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc
@@ -5,7 +5,10 @@ from os import path, makedirs
 
 from shell import Shell
 from ext4 import FileSystem
-from ext4.restore import restore_deleted_files, DEFAULT_RESTORED_DIR
+from ext4.restore import restore_deleted_files, DEFAULT_RESTORED_DIR, \
+                         DEFAULT_MIN_RECOVERABLE
+from ext4.jmap import INDEX_SUFFIX
+from ext4.filters import RestoreFilter, FILE_TYPES, parse_size, parse_time
 from logger import Logger, LogType
 
 
@@ -28,6 +31,62 @@ parser.add_argument('--restore', action='store_true',
 parser.add_argument('--output', '-o', type=str, default=DEFAULT_RESTORED_DIR,
                     help='path to restored files')
 
+parser.add_argument('--min-recoverable', type=float, metavar='FRACTION',
+                    default=DEFAULT_MIN_RECOVERABLE,
+                    help='skip deleted files whose estimated fraction of '
+                         'not overwritten blocks is less than FRACTION')
+
+parser.add_argument('--check-live', action='store_true',
+                    help='also check data blocks of deleted files against '
+                         'blocks of live files (slower)')
+
+parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+                    help='search deleted files with N worker processes')
+
+parser.add_argument('--journal-sweep', action='store_true',
+                    help='use all block copies found in journal, even from '
+                         'uncommitted or revoked transactions '
+                         '(for damaged journals)')
+
+parser.add_argument('--journal-index', type=str, metavar='PATH',
+                    help='journal map index file, reused while image is not '
+                         'changed (default: SOURCE{})'.format(INDEX_SUFFIX))
+
+parser.add_argument('--no-journal-index', action='store_true',
+                    help='always scan journal, do not read or write index')
+
+filters = parser.add_argument_group(
+    'restore filters',
+    'TIME is unix timestamp, ISO date and time or age like 90m, 2h, 3d; '
+    'SIZE is count of bytes with optional suffix K, M, G')
+
+filters.add_argument('--deleted-after', type=parse_time, metavar='TIME')
+
+filters.add_argument('--deleted-before', type=parse_time, metavar='TIME')
+
+filters.add_argument('--modified-after', type=parse_time, metavar='TIME')
+
+filters.add_argument('--modified-before', type=parse_time, metavar='TIME')
+
+filters.add_argument('--min-size', type=parse_size, metavar='SIZE')
+
+filters.add_argument('--max-size', type=parse_size, metavar='SIZE')
+
+filters.add_argument('--uid', type=int, help='restore files of this owner')
+
+filters.add_argument('--gid', type=int, help='restore files of this group')
+
+filters.add_argument('--type', choices=sorted(FILE_TYPES), dest='file_type',
+                     help='restore files of this type only')
+
+filters.add_argument('--magic', type=bytes.fromhex, action='append',
+                     default=[], metavar='HEX',
+                     help='restore files starting with this signature '
+                          '(may be repeated)')
+
+filters.add_argument('--magic-offset', type=int, default=0, metavar='N',
+                     help='offset of signature in file')
+
 parser.add_argument('--version', action='version', version=VERSION)
 
 parser.add_argument('--verbose', '-v', action='count')
@@ -49,7 +108,19 @@ if __name__ == '__main__':
                 Logger.log(args.output + ' does not exist. I created it.',
                            LogType.warning)
                 makedirs(args.output)
-            restore_deleted_files(fs, args.output)
+            index_path = args.journal_index or args.image + INDEX_SUFFIX
+            if args.no_journal_index:
+                index_path = None
+            restore_filter = RestoreFilter(
+                dtime=(args.deleted_after, args.deleted_before),
+                mtime=(args.modified_after, args.modified_before),
+                size=(args.min_size, args.max_size),
+                uid=args.uid, gid=args.gid, file_type=args.file_type,
+                magic=args.magic, magic_offset=args.magic_offset)
+            restore_deleted_files(fs, args.output, args.min_recoverable,
+                                  args.check_live, args.jobs, args.image,
+                                  args.journal_sweep, index_path,
+                                  restore_filter)
 
         else:
             shell = Shell(fs, APPLICATION, VERSION)
@@ -6,8 +6,14 @@ from ext4.tests.test_filesystem import *
 from ext4.tests.test_structs import *
 from ext4.tests.test_fsinfo import *
 from ext4.tests.test_utils import *
-
-from cmapping.tests import *
+from ext4.tests.test_cache import *
+from ext4.tests.test_htree import *
+from ext4.tests.test_extents import *
+from ext4.tests.test_scan import *
+from ext4.tests.test_bitmap import *
+from ext4.tests.test_restore import *
+from ext4.tests.test_journal import *
+from ext4.tests.test_filters import *
 
 
 unittest.main()
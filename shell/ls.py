@@ -41,7 +41,7 @@ class Ls:
             self.shell.print_error(IS_FILE.format(path=abspath))
             return
 
-        for entry in d:
+        for entry in d.scandir():
             mod_time = datetime.fromtimestamp(entry.mod_time)
             print(FORMAT.format(mode=entry.mode_str, links=entry.links,
                                 owner=entry.owner, group=entry.group,